@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# Reports the compression ratio and throughput of each available codec in
+# secfs.store.compress, on text-like and on incompressible data, chunked the
+# same way file contents are.
+#
+# Usage: bench/compress.py [--size MB] [FILE...]
+
+import os
+import time
+import random
+import argparse
+
+import secfs.store.compress
+from secfs.store.inode import BLOCK_SIZE
+
+def timed(f, *args):
+    start = time.perf_counter()
+    ret = f(*args)
+    return ret, time.perf_counter() - start
+
+def log_lines(size):
+    r = random.Random(0)
+    levels = ["INFO", "WARN", "DEBUG", "ERROR"]
+    out = []
+    n = 0
+    while n < size:
+        line = "2024-01-{:02d} 12:{:02d}:{:02d} {} worker-{} handled request {} in {} ms\n".format(
+            r.randint(1, 31), r.randint(0, 59), r.randint(0, 59), r.choice(levels),
+            r.randint(0, 16), r.randint(0, 1 << 32), r.randint(0, 5000)).encode()
+        out.append(line)
+        n += len(line)
+    return b"".join(out)[:size]
+
+def csv_rows(size):
+    r = random.Random(1)
+    out = [b"id,name,price,quantity\n"]
+    n = len(out[0])
+    k = 0
+    while n < size:
+        row = "{},item{},{:.2f},{}\n".format(k, r.randint(0, 1000), r.random() * 100, r.randint(0, 50)).encode()
+        out.append(row)
+        n += len(row)
+        k += 1
+    return b"".join(out)[:size]
+
+def run(name, data):
+    chunks = [data[off:off+BLOCK_SIZE] for off in range(0, len(data), BLOCK_SIZE)]
+    mb = len(data) / (1024 * 1024)
+    for codec in ["none"] + sorted(secfs.store.compress.codecs):
+        if codec == "none":
+            codec = None
+        blobs, ctime = timed(lambda: [secfs.store.compress.compress(c, codec) for c in chunks])
+        _, dtime = timed(lambda: [secfs.store.compress.decompress(b) for b in blobs])
+        stored = sum(1 for b in blobs if b[0] == secfs.store.compress.STORED)
+        print("{:>8} {:>5}: ratio {:6.2f}  compress {:8.1f} MB/s  decompress {:8.1f} MB/s  {}/{} chunks stored as-is".format(
+            name, codec or "none", len(data) / sum(len(b) for b in blobs), mb / ctime, mb / dtime, stored, len(blobs)))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=16, help="size of each generated data set in MB")
+    parser.add_argument("files", nargs="*", help="also measure the contents of these files")
+    args = parser.parse_args()
+
+    size = args.size * 1024 * 1024
+    run("log", log_lines(size))
+    run("csv", csv_rows(size))
+    run("random", os.urandom(size))
+    for path in args.files:
+        with open(path, "rb") as f:
+            run(os.path.basename(path), f.read())
+
+if __name__ == '__main__':
+    main()
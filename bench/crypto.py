@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+# Compares the throughput of whole-message Fernet encryption with per-block
+# AES-GCM encryption in secfs.crypto, and the cost of reading a single block
+# out of an encrypted file with each.
+#
+# Usage: bench/crypto.py [--size MB] [--block KB]
+
+import os
+import time
+import argparse
+
+import secfs.crypto
+from cryptography.fernet import Fernet
+
+def timed(f, *args):
+    start = time.perf_counter()
+    ret = f(*args)
+    return ret, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=64, help="file size in MB")
+    parser.add_argument("--block", type=int, default=64, help="block size in KB")
+    args = parser.parse_args()
+
+    size = args.size * 1024 * 1024
+    bs = args.block * 1024
+    data = os.urandom(size)
+    blocks = [data[off:off+bs] for off in range(0, size, bs)]
+    mb = size / (1024 * 1024)
+    file_id = b"bench"
+
+    fkey = Fernet.generate_key()
+    ct, enc = timed(secfs.crypto.encrypt_sym, fkey, data)
+    _, dec = timed(secfs.crypto.decrypt_sym, fkey, ct)
+    # a Fernet token must be decrypted as a whole to read any part of it
+    one = dec
+    print("  fernet: encrypt {:8.1f} MB/s  decrypt {:8.1f} MB/s  one block {:8.3f} ms  overhead {:6.2f}%".format(
+        mb / enc, mb / dec, one * 1000, 100 * (len(ct) - size) / size))
+
+    bkey = secfs.crypto.generate_block_key()
+    cts, enc = timed(lambda: [secfs.crypto.encrypt_block(bkey, b, file_id, n) for n, b in enumerate(blocks)])
+    _, dec = timed(lambda: [secfs.crypto.decrypt_block(bkey, b, file_id, n) for n, b in enumerate(cts)])
+    n = len(cts) // 2
+    _, one = timed(secfs.crypto.decrypt_block, bkey, cts[n], file_id, n)
+    print("  aesgcm: encrypt {:8.1f} MB/s  decrypt {:8.1f} MB/s  one block {:8.3f} ms  overhead {:6.2f}%".format(
+        mb / enc, mb / dec, one * 1000, 100 * (sum(len(c) for c in cts) - size) / size))
+
+if __name__ == '__main__':
+    main()
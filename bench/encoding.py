@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# Compares the size and encode/decode time of the pickle and binary encodings
+# of inodes, itable chunks and directory buckets.
+#
+# Usage: bench/encoding.py [--blocks N] [--rounds N]
+
+import os
+import time
+import pickle
+import argparse
+
+import secfs.tables
+import secfs.store.tree
+from secfs.store.inode import Inode
+from secfs.types import I, User, Group
+
+def timed(rounds, f, *args):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        ret = f(*args)
+    return ret, (time.perf_counter() - start) / rounds
+
+def inode_pickle(node):
+    # the encoding inodes used before the binary one
+    return pickle.dumps(node.__dict__)
+
+def report(name, rounds, value, penc, pdec, benc, bdec):
+    p, pe = timed(rounds, penc, value)
+    _, pd = timed(rounds, pdec, p)
+    b, be = timed(rounds, benc, value)
+    _, bd = timed(rounds, bdec, b)
+    print("{:>9}: pickle {:7d} B  enc {:8.1f} us  dec {:8.1f} us | binary {:7d} B  enc {:8.1f} us  dec {:8.1f} us".format(
+        name, len(p), pe * 1e6, pd * 1e6, len(b), be * 1e6, bd * 1e6))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--blocks", type=int, default=1024, help="number of blocks in the inode")
+    parser.add_argument("--rounds", type=int, default=1000, help="number of times to repeat each operation")
+    args = parser.parse_args()
+
+    node = Inode()
+    node.kind = 1
+    node.size = args.blocks * node.bsize
+    node.ctime = time.time()
+    node.mtime = node.ctime
+    node.blocks = [os.urandom(28).hex() for _ in range(args.blocks)]
+    report("inode", args.rounds, node, inode_pickle, pickle.loads, Inode.bytes, Inode.from_bytes)
+
+    # itables keep raw hashes in memory
+    chunk = {n: os.urandom(28) for n in range(secfs.tables.ITABLE_CHUNK)}
+    report("itable", args.rounds, chunk, pickle.dumps, pickle.loads,
+           secfs.tables._pack_chunk, secfs.tables._unpack_chunk)
+
+    chunk = {n: I(User(1000 + n % 8), n) for n in range(secfs.tables.ITABLE_CHUNK)}
+    report("group", args.rounds, chunk, pickle.dumps, pickle.loads,
+           secfs.tables._pack_chunk, secfs.tables._unpack_chunk)
+
+    u = User(1000)
+    bucket = [("file{}".format(n).encode(), I(u, n)) for n in range(secfs.store.tree.BUCKET_ENTRIES)]
+    report("directory", args.rounds, bucket, pickle.dumps, pickle.loads,
+           secfs.store.tree._pack_bucket, secfs.store.tree._unpack_bucket)
+
+if __name__ == '__main__':
+    main()
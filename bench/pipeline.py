@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+# Measures how block preparation (encryption and hashing) on the block
+# pipeline in secfs.store.pipeline scales with the number of worker threads.
+#
+# Usage: bench/pipeline.py [--size MB] [--block KB] [workers...]
+
+import os
+import time
+import hashlib
+import argparse
+
+import secfs.crypto
+import secfs.store.pipeline
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=256, help="amount of data to prepare in MB")
+    parser.add_argument("--block", type=int, default=64, help="block size in KB")
+    parser.add_argument("workers", nargs="*", type=int)
+    args = parser.parse_args()
+
+    counts = args.workers
+    if len(counts) == 0:
+        counts = [1]
+        while counts[-1] * 2 <= (os.cpu_count() or 1):
+            counts.append(counts[-1] * 2)
+
+    size = args.size * 1024 * 1024
+    bs = args.block * 1024
+    data = os.urandom(size)
+    blocks = [data[off:off+bs] for off in range(0, size, bs)]
+    indexes = list(range(len(blocks)))
+    key = secfs.crypto.generate_block_key()
+
+    def prepare(block, index):
+        ct = secfs.crypto.encrypt_block(key, block, b"bench", index)
+        return hashlib.sha224(ct).hexdigest(), ct
+
+    base = None
+    for n in counts:
+        secfs.store.pipeline.set_workers(n)
+        start = time.perf_counter()
+        secfs.store.pipeline.map(prepare, blocks, indexes)
+        t = time.perf_counter() - start
+        if base is None:
+            base = t
+        print("{:>3} workers: {:8.1f} MB/s  speedup {:5.2f}x".format(n, args.size / t, base / t))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# Measures single-stream sequential read throughput from a file stored on a
+# real secfs-server, read the way FUSE reads it, once without read-ahead and
+# once for each given read-ahead window. A simulated network round-trip time
+# is added to every request, as a local socket has next to none.
+#
+# Usage: bench/readahead.py [--size MB] [--read KB] [--rtt MS] [windows...]
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+import Pyro4
+import secfs.fs
+import secfs.store.block
+from secfs.store.inode import Inode
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from transport import start_server
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=32, help="size of the file in MB")
+    parser.add_argument("--read", type=int, default=128, help="KB per read, as issued by FUSE")
+    parser.add_argument("--rtt", type=float, default=5, help="simulated round-trip time in ms")
+    parser.add_argument("windows", nargs="*", type=int, default=[0, 4, 16, 64])
+    args = parser.parse_args()
+
+    call = secfs.store.block._call
+    def delayed(target, method, arg):
+        time.sleep(args.rtt / 1000)
+        return call(target, method, arg)
+    secfs.store.block._call = delayed
+
+    size = args.size * 1024 * 1024
+    step = args.read * 1024
+    with tempfile.TemporaryDirectory() as d:
+        p, uri = start_server(os.path.join(d, "readahead.sock"))
+        try:
+            secfs.store.block.register(Pyro4.Proxy(uri))
+            node = Inode()
+            node.kind = 1
+            node.write(0, os.urandom(size))
+            node.bytes()
+
+            for window in args.windows:
+                # start every run from a cold cache
+                capacity = secfs.store.block.cache_capacity
+                secfs.store.block.set_cache_capacity(0)
+                secfs.store.block.set_cache_capacity(capacity)
+
+                readahead = secfs.fs.Readahead(window)
+                start = time.perf_counter()
+                for off in range(0, size, step):
+                    readahead.access(node, off, step)
+                    node.read_range(off, step)
+                t = time.perf_counter() - start
+                readahead.cancel()
+                print("window {:3d} chunks: {:8.1f} MB/s".format(window, args.size / t))
+        finally:
+            p.terminate()
+            p.wait()
+
+if __name__ == '__main__':
+    main()
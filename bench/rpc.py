@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# Measures how long multi-block operations take against a real secfs-server
+# when requests are issued one at a time, as one batch, or spread over several
+# concurrent connections. A simulated network round-trip time is added to
+# every request, as a local socket has next to none.
+#
+# Usage: bench/rpc.py [--blocks N] [--rtt MS] [connections...]
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+import Pyro4
+import secfs.store.block
+from secfs.store.inode import BLOCK_SIZE
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from transport import start_server
+
+def timed(f, *args):
+    start = time.perf_counter()
+    ret = f(*args)
+    return ret, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--blocks", type=int, default=64, help="number of blocks per operation")
+    parser.add_argument("--rtt", type=float, default=5, help="simulated round-trip time in ms")
+    parser.add_argument("connections", nargs="*", type=int, default=[1, 4, 16])
+    args = parser.parse_args()
+
+    call = secfs.store.block._call
+    def delayed(target, method, arg):
+        time.sleep(args.rtt / 1000)
+        return call(target, method, arg)
+    secfs.store.block._call = delayed
+
+    blocks = [os.urandom(BLOCK_SIZE) for _ in range(args.blocks)]
+    mb = args.blocks * BLOCK_SIZE / (1024 * 1024)
+    print("{} blocks of {} KB, {} ms round-trip; one round-trip plus transfer is the target".format(
+        args.blocks, BLOCK_SIZE // 1024, args.rtt))
+
+    with tempfile.TemporaryDirectory() as d:
+        p, uri = start_server(os.path.join(d, "rpc.sock"))
+        try:
+            for connections in args.connections:
+                secfs.store.block.set_connections(connections)
+                secfs.store.block.register(Pyro4.Proxy(uri))
+                secfs.store.block.set_cache_capacity(0)
+
+                chashes, one = timed(lambda: [secfs.store.block.store(b) for b in blocks])
+                _, stores = timed(lambda: [f.result() for f in [secfs.store.block.store_async(b) for b in blocks]])
+                _, batch = timed(secfs.store.block.store_many, blocks)
+                print("{:3d} connections: store  one-by-one {:8.1f} ms  async {:8.1f} ms  batched {:8.1f} ms ({:.1f} MB/s)".format(
+                    connections, one * 1000, stores * 1000, batch * 1000, mb / batch))
+
+                _, one = timed(lambda: [secfs.store.block.load(c) for c in chashes])
+                _, loads = timed(lambda: [f.result() for f in [secfs.store.block.load_async(c) for c in chashes]])
+                _, batch = timed(secfs.store.block.load_many, chashes)
+                print("{:3d} connections: load   one-by-one {:8.1f} ms  async {:8.1f} ms  batched {:8.1f} ms ({:.1f} MB/s)".format(
+                    connections, one * 1000, loads * 1000, batch * 1000, mb / batch))
+        finally:
+            p.terminate()
+            p.wait()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# Measures aggregate block store and load bandwidth against a real
+# secfs-server, once for each given number of shard processes (0 meaning an
+# unsharded server), with several client processes issuing batched requests
+# at the same time.
+#
+# Usage: bench/shards.py [--size MB] [--batch N] [--clients N] [shards...]
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+import subprocess
+import multiprocessing
+
+import Pyro4
+import secfs.store.block
+from secfs.store.inode import BLOCK_SIZE
+
+def start_server(sock, shards):
+    """
+    Start a fresh secfs-server with the given number of shards listening on
+    the given Unix socket, and return the process along with its URI.
+    """
+    server = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bin", "secfs-server")
+    cmd = [sys.executable, server, sock, "--shards", str(shards)]
+    p = subprocess.Popen(cmd, stdout=subprocess.PIPE, universal_newlines=True)
+    for line in p.stdout:
+        if line.startswith("uri = "):
+            return p, line.split()[2]
+    raise RuntimeError("secfs-server exited before announcing its URI")
+
+def client(uri, size, batch, start):
+    """
+    Stores size bytes of fresh blocks in batches of the given number of
+    blocks, and then loads them all back. Waits until start (in time.time())
+    so that all clients run at once, and returns the time each phase took.
+    """
+    secfs.store.block.register(Pyro4.Proxy(uri))
+    secfs.store.block.set_cache_capacity(0)
+    blocks = [os.urandom(BLOCK_SIZE) for _ in range(size // BLOCK_SIZE)]
+    batches = [blocks[n:n+batch] for n in range(0, len(blocks), batch)]
+
+    time.sleep(max(0, start - time.time()))
+    t = time.perf_counter()
+    chashes = [secfs.store.block.store_many(b) for b in batches]
+    stime = time.perf_counter() - t
+
+    t = time.perf_counter()
+    for c in chashes:
+        secfs.store.block.load_many(c)
+    ltime = time.perf_counter() - t
+    return stime, ltime
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=64, help="MB of blocks stored by each client")
+    parser.add_argument("--batch", type=int, default=32, help="blocks per request")
+    parser.add_argument("--clients", type=int, default=4, help="number of client processes")
+    parser.add_argument("shards", nargs="*", type=int, default=[0, 1, 2, 4])
+    args = parser.parse_args()
+
+    size = args.size * 1024 * 1024
+    mb = args.clients * args.size
+    with tempfile.TemporaryDirectory() as d, multiprocessing.Pool(args.clients) as pool:
+        for shards in args.shards:
+            p, uri = start_server(os.path.join(d, "{}.sock".format(shards)), shards)
+            try:
+                start = time.time() + 1
+                times = pool.starmap(client, [(uri, size, args.batch, start)] * args.clients)
+            finally:
+                p.terminate()
+                p.wait()
+            # clients start together, so the slowest one bounds the aggregate
+            stime = max(s for s, _ in times)
+            ltime = max(l for _, l in times)
+            print("{} shards: store {:8.1f} MB/s  load {:8.1f} MB/s".format(shards, mb / stime, mb / ltime))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+# Runs a suite of file system workloads through secfs.fs, without FUSE, and
+# reports ops/s, bytes/s and server RPCs per operation for each. By default
+# the client talks to secfs.local's LocalServer, an in-process stand-in for
+# secfs-server's SecFSRPC; --server starts a real secfs-server for each
+# workload instead, and --uri uses one that is already running. The results
+# can be written to a JSON report, and compared against an earlier one.
+#
+# Usage: bench/suite.py [--server | --uri URI] [--scale N] [--json FILE]
+#                       [--compare FILE] [workload...]
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import subprocess
+
+import Pyro4
+
+# secfs need not be installed; it is in the directory above this one
+bench = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(bench))
+sys.path.insert(0, bench)
+
+import secfs.fs
+import secfs.local
+import secfs.crypto
+import secfs.tables
+import secfs.metrics
+import secfs.store.tree
+import secfs.store.inode
+from transport import start_server
+
+class Counted:
+    """
+    Wraps a server (or a proxy for one), and counts the calls made through
+    it by method name.
+    """
+    def __init__(self, server):
+        self.server = server
+        self.calls = {}
+
+    def __getattr__(self, name):
+        f = getattr(self.server, name)
+        def call(*args):
+            self.calls[name] = self.calls.get(name, 0) + 1
+            return f(*args)
+        return call
+
+class Client:
+    """
+    A fresh SecFS share on the given server, operated on as owner. Every
+    operation is bracketed by a lock and a publish of the changed itables,
+    the way secfs-fuse brackets FUSE operations with _pre and _post, but the
+    user and group maps are never reloaded from the share.
+    """
+    def __init__(self, server, proxy=None):
+        self.server = Counted(server)
+        self.root = secfs.local.mount(self.server, server if proxy is None else proxy)
+        self.owner = secfs.local.owner
+        self.group = secfs.local.group
+
+    def op(self, f, *args, shared=False):
+        if shared:
+            self.server.lock_shared()
+        else:
+            self.server.lock()
+        try:
+            return f(*args)
+        finally:
+            secfs.tables.post(True)
+            if shared:
+                self.server.unlock_shared()
+            else:
+                self.server.unlock()
+
+    def rpcs(self):
+        """
+        Returns the number of calls made to the server so far, by method.
+        Block RPCs are counted by secfs.metrics, as they do not go through
+        self.server.
+        """
+        calls = dict(self.server.calls)
+        with secfs.metrics.lock:
+            for name, h in secfs.metrics.histograms.items():
+                if name.startswith("rpc."):
+                    calls[name[4:]] = calls.get(name[4:], 0) + h.count
+        return calls
+
+    def create(self, parent, name, owner=None):
+        return self.op(secfs.local.create, parent, name, False, owner or self.owner)
+
+    def mkdir(self, parent, name, owner=None):
+        return self.op(secfs.local.create, parent, name, True, owner or self.owner)
+
+    def lookup(self, parent, name):
+        return self.op(secfs.store.tree.find_under, parent, name, shared=True)
+
+    def readdir(self, i):
+        return self.op(secfs.fs.readdir_attrs, i, 0, shared=True)
+
+    def write(self, i, off, buf):
+        return self.op(secfs.fs.write, self.owner, i, off, buf)
+
+    def read(self, i, off, size):
+        return self.op(secfs.fs.read, self.owner, i, off, size, shared=True)
+
+def encrypting(key):
+    """
+    Returns a transform for secfs.store.inode.transforms that encrypts every
+    chunk with the given key, using per-block AES-GCM from secfs.crypto.
+    """
+    return (lambda node, index, chunk: secfs.crypto.encrypt_block(key, chunk, b"suite", index),
+            lambda node, index, chunk: secfs.crypto.decrypt_block(key, chunk, b"suite", index))
+
+# Every workload takes a Client and the scale, and returns the number of
+# operations it performed and the number of bytes of file contents it moved.
+
+def create_storm(c, scale):
+    n = 100 * scale
+    for k in range(n):
+        c.create(c.root, "f{}".format(k).encode())
+    return n, 0
+
+def wide_dir(c, scale):
+    n = 100 * scale
+    d = c.mkdir(c.root, b"wide")
+    for k in range(n):
+        c.create(d, "f{}".format(k).encode())
+    for k in range(n):
+        c.lookup(d, "f{}".format(k).encode())
+    c.readdir(d)
+    return 2 * n + 1, 0
+
+def deep_dir(c, scale):
+    depth = 10 * scale
+    d = c.root
+    for k in range(depth):
+        d = c.mkdir(d, b"d")
+    # walk the whole path from the root, as a path lookup would
+    for _ in range(scale):
+        d = c.root
+        for k in range(depth):
+            d = c.lookup(d, b"d")
+    return depth + depth * scale, 0
+
+def _sequential(c, scale, io=128 * 1024):
+    size = 4 * scale * 1024 * 1024
+    i = c.create(c.root, b"big")
+    buf = os.urandom(io)
+    for off in range(0, size, io):
+        c.write(i, off, buf)
+    for off in range(0, size, io):
+        c.read(i, off, io)
+    return 2 * (size // io), 2 * size
+
+def seq_io(c, scale):
+    return _sequential(c, scale)
+
+def rand_io(c, scale, io=4096):
+    size = 4 * scale * 1024 * 1024
+    i = c.create(c.root, b"big")
+    c.write(i, 0, os.urandom(size))
+    r = random.Random(0)
+    n = 100 * scale
+    buf = os.urandom(io)
+    for _ in range(n):
+        c.write(i, r.randrange(0, size - io), buf)
+    for _ in range(n):
+        c.read(i, r.randrange(0, size - io), io)
+    return 2 * n, 2 * n * io
+
+def group_files(c, scale):
+    n = 50 * scale
+    d = c.mkdir(c.root, b"shared", c.group)
+    buf = os.urandom(4096)
+    for k in range(n):
+        i = c.create(d, "f{}".format(k).encode(), c.group)
+        c.write(i, 0, buf)
+        c.read(i, 0, len(buf))
+    return 3 * n, 2 * n * len(buf)
+
+def encrypted_io(c, scale):
+    secfs.store.inode.transforms.append(encrypting(secfs.crypto.generate_block_key()))
+    try:
+        return _sequential(c, scale)
+    finally:
+        secfs.store.inode.transforms.pop()
+
+workloads = {
+    # name => function
+    "create": create_storm,
+    "wide": wide_dir,
+    "deep": deep_dir,
+    "seq": seq_io,
+    "random": rand_io,
+    "group": group_files,
+    "encrypted": encrypted_io,
+}
+
+def run(name, target, scale):
+    """
+    Runs the named workload against a fresh share on the given target (None
+    for a LocalServer, or a server URI), and returns its results.
+    """
+    if target is None:
+        c = Client(secfs.local.LocalServer())
+    else:
+        c = Client(Pyro4.Proxy(target), Pyro4.Proxy(target))
+    secfs.metrics.reset()
+
+    start = time.perf_counter()
+    ops, nbytes = workloads[name](c, scale)
+    t = time.perf_counter() - start
+
+    rpcs = c.rpcs()
+    return {
+        "ops": ops,
+        "bytes": nbytes,
+        "seconds": t,
+        "ops_per_s": ops / t,
+        "bytes_per_s": nbytes / t,
+        "rpcs_per_op": sum(rpcs.values()) / ops,
+        "rpcs": rpcs,
+    }
+
+def revision():
+    try:
+        return subprocess.check_output(["git", "describe", "--always", "--dirty"],
+                cwd=os.path.dirname(os.path.abspath(__file__)), universal_newlines=True,
+                stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser()
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--server", action="store_true", help="run each workload against a fresh secfs-server")
+    target.add_argument("--uri", help="run against the secfs-server at this URI")
+    parser.add_argument("--scale", type=int, default=1, help="multiplies the size of every workload")
+    parser.add_argument("--json", metavar="FILE", help="write a JSON report to FILE")
+    parser.add_argument("--compare", metavar="FILE", help="compare against an earlier JSON report")
+    parser.add_argument("workloads", nargs="*", default=list(workloads), help="any of: " + ", ".join(workloads))
+    args = parser.parse_args()
+    for name in args.workloads:
+        if name not in workloads:
+            parser.error("unknown workload {}".format(name))
+
+    old = None
+    if args.compare is not None:
+        with open(args.compare) as f:
+            old = json.load(f)["workloads"]
+
+    results = {}
+    with tempfile.TemporaryDirectory() as d:
+        for name in args.workloads:
+            if args.server:
+                p, uri = start_server(os.path.join(d, "{}.sock".format(name)))
+                try:
+                    results[name] = run(name, uri, args.scale)
+                finally:
+                    p.terminate()
+                    p.wait()
+            else:
+                results[name] = run(name, args.uri, args.scale)
+
+            r = results[name]
+            line = "{:>10}: {:10.1f} ops/s {:8.2f} MB/s {:7.2f} rpcs/op".format(
+                name, r["ops_per_s"], r["bytes_per_s"] / (1024 * 1024), r["rpcs_per_op"])
+            if old is not None and name in old:
+                line += "  ({:+.1f}% ops/s, {:+.2f} rpcs/op)".format(
+                    100 * (r["ops_per_s"] / old[name]["ops_per_s"] - 1), r["rpcs_per_op"] - old[name]["rpcs_per_op"])
+            print(line)
+
+    if args.json is not None:
+        report = {
+            "revision": revision(),
+            "time": time.time(),
+            "target": "server" if args.server else args.uri or "local",
+            "scale": args.scale,
+            "workloads": results,
+        }
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+if __name__ == '__main__':
+    main()
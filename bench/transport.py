@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# Measures large-file read and write throughput through secfs.fs against a
+# real secfs-server, once for each Pyro serializer used for block traffic.
+#
+# Usage: bench/transport.py [--size MB] [--io KB] [serializer...]
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+import subprocess
+
+import Pyro4
+import secfs.fs
+import secfs.tables
+import secfs.store.block
+from secfs.store.inode import Inode
+from secfs.types import I, User, Group
+
+def start_server(sock):
+    """
+    Start a fresh secfs-server listening on the given Unix socket, and return
+    the process along with the server's URI.
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    server = os.path.join(root, "bin", "secfs-server")
+    # the server imports secfs too, which need not be installed
+    env = dict(os.environ)
+    paths = [root]
+    if "PYTHONPATH" in env:
+        paths.append(env["PYTHONPATH"])
+    env["PYTHONPATH"] = os.pathsep.join(paths)
+    p = subprocess.Popen([sys.executable, server, sock], stdout=subprocess.PIPE, universal_newlines=True, env=env)
+    for line in p.stdout:
+        if line.startswith("uri = "):
+            return p, line.split()[2]
+    raise RuntimeError("secfs-server exited before announcing its URI")
+
+def new_file(owner):
+    node = Inode()
+    node.kind = 1
+    node.ctime = time.time()
+    node.mtime = node.ctime
+    ihash = secfs.store.block.store(node.bytes())
+    return secfs.tables.modmap(owner, I(owner), ihash)
+
+def run(uri, serializer, size, io):
+    secfs.store.block.serializer = serializer
+    proxy = Pyro4.Proxy(uri)
+    secfs.tables.register(proxy)
+    secfs.store.block.register(proxy)
+    secfs.tables.current_itables = {}
+
+    # make sure every read actually goes to the server
+    secfs.store.block.set_cache_capacity(0)
+
+    owner = User(0)
+    secfs.fs.init(owner, {owner: b""}, {Group(100): [owner]})
+    i = new_file(owner)
+
+    buf = os.urandom(io)
+    start = time.perf_counter()
+    for off in range(0, size, io):
+        secfs.fs.write(owner, i, off, buf)
+    wtime = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for off in range(0, size, io):
+        secfs.fs.read(owner, i, off, io)
+    rtime = time.perf_counter() - start
+
+    mb = size / (1024 * 1024)
+    return mb / wtime, mb / rtime
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=64, help="file size in MB")
+    parser.add_argument("--io", type=int, default=1024, help="size of each read and write in KB")
+    parser.add_argument("serializers", nargs="*", default=["serpent", "marshal"])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as d:
+        for serializer in args.serializers:
+            p, uri = start_server(os.path.join(d, "{}.sock".format(serializer)))
+            try:
+                w, r = run(uri, serializer, args.size * 1024 * 1024, args.io * 1024)
+            finally:
+                p.terminate()
+                p.wait()
+            print("{:>8}: write {:8.1f} MB/s  read {:8.1f} MB/s".format(serializer, w, r))
+
+if __name__ == '__main__':
+    main()
@@ -5,11 +5,41 @@ from cryptography.hazmat.primitives.asymmetric import rsa
 from cryptography.hazmat.primitives import serialization
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from cryptography.fernet import Fernet
 from secfs.types import I, Principal, User, Group
+from collections import OrderedDict
+import struct
+import threading
+import os
 
 keys = {}
 
+# cipher objects are expensive to set up, so we keep the ones for recently
+# used symmetric keys around. the cache is shared by FUSE workers and block
+# pipeline threads, so it is guarded by ciphers_lock.
+CIPHER_CACHE_SIZE = 256
+ciphers = OrderedDict()
+ciphers_lock = threading.Lock()
+
+def _cipher(kind, key):
+    """
+    Returns a (cached) cipher object of the given kind (Fernet or AESGCM) for
+    the given key.
+    """
+    k = (kind, key)
+    with ciphers_lock:
+        if k in ciphers:
+            ciphers.move_to_end(k)
+            return ciphers[k]
+
+    c = kind(key)
+    with ciphers_lock:
+        ciphers[k] = c
+        if len(ciphers) > CIPHER_CACHE_SIZE:
+            ciphers.popitem(last=False)
+    return c
+
 def register_keyfile(user, f):
     """
     Register the private key for the given user for use in signing/decrypting.
@@ -29,16 +59,50 @@ def decrypt_sym(key, data):
     """
     Decrypt the given data with the given key.
     """
-    f = Fernet(key)
+    f = _cipher(Fernet, key)
     return f.decrypt(data)
 
 def encrypt_sym(key, data):
     """
     Encrypt the given data with the given key.
     """
-    f = Fernet(key)
+    f = _cipher(Fernet, key)
     return f.encrypt(data)
 
+# Block encryption uses AES-GCM, which authenticates each block on its own, so
+# any block of a file can be decrypted (or replaced) without touching the rest.
+# Every encryption uses a fresh random nonce, since blocks are rewritten under
+# the same key. The file and block index are bound to the ciphertext as
+# associated data, so a block cannot be moved to another file or position
+# without failing authentication.
+BLOCK_NONCE_SIZE = 12
+
+def generate_block_key():
+    """
+    Generate a new random key for use with encrypt_block/decrypt_block.
+    """
+    return AESGCM.generate_key(bit_length=256)
+
+def _block_ad(file_id, index):
+    return struct.pack(">Q", index) + file_id
+
+def encrypt_block(key, data, file_id, index):
+    """
+    Encrypt the given data as the index-th block of the file identified by
+    the bytestring file_id.
+    """
+    nonce = os.urandom(BLOCK_NONCE_SIZE)
+    return nonce + _cipher(AESGCM, key).encrypt(nonce, data, _block_ad(file_id, index))
+
+def decrypt_block(key, data, file_id, index):
+    """
+    Decrypt the given index-th block of the file identified by the bytestring
+    file_id. Raises cryptography.exceptions.InvalidTag if the block has been
+    tampered with, or does not belong at the given file and index.
+    """
+    nonce = data[:BLOCK_NONCE_SIZE]
+    return _cipher(AESGCM, key).decrypt(nonce, data[BLOCK_NONCE_SIZE:], _block_ad(file_id, index))
+
 def generate_key(user):
     """
     Ensure that a private/public keypair exists in user-$uid-key.pem for the
@@ -1,7 +1,10 @@
 # This file implements file system operations at the level of inodes.
 
 import time
+import logging
+import threading
 import secfs.crypto
+import secfs.metrics
 import secfs.tables
 import secfs.access
 import secfs.store.tree
@@ -11,6 +14,8 @@ from secfs.store.tree import Directory
 from cryptography.fernet import Fernet
 from secfs.types import I, Principal, User, Group
 
+log = logging.getLogger(__name__)
+
 # usermap contains a map from user ID to their public key according to /.users
 usermap = {}
 # groupmap contains a map from group ID to the list of members according to /.groups
@@ -57,7 +62,7 @@ def init(owner, users, groups):
     secfs.tables.modmap(owner, root_i, new_ihash)
     new_ihash = secfs.store.tree.add(root_i, b'..', root_i)
     secfs.tables.modmap(owner, root_i, new_ihash)
-    print("CREATED ROOT AT", new_ihash)
+    log.info("created root at %s", new_ihash)
 
     init = {
         b".users": users,
@@ -70,10 +75,9 @@ def init(owner, users, groups):
 
         node = Inode()
         node.kind = 1
-        node.size = len(bts)
         node.mtime = node.ctime
         node.ctime = time.time()
-        node.blocks = [secfs.store.block.store(bts)]
+        node.write(0, bts)
 
         ihash = secfs.store.block.store(node.bytes())
         i = secfs.tables.modmap(owner, I(owner), ihash)
@@ -143,9 +147,10 @@ def mkdir(parent_i, name, create_as, create_for):
     """
     return _create(parent_i, name, create_as, create_for, True)
 
-def read(read_as, i, off, size):
+def read(read_as, i, off, size, readahead=None):
     """
-    Read reads [off:off+size] bytes from the file at i.
+    Read reads [off:off+size] bytes from the file at i. If a Readahead is
+    given, it is told about the read so that it can prefetch what follows.
     """
     if not isinstance(i, I):
         raise TypeError("{} is not an I, is a {}".format(i, type(i)))
@@ -158,12 +163,23 @@ def read(read_as, i, off, size):
         else:
             raise PermissionError("cannot read from user-readable file {0} as {1}".format(i, read_as))
 
-    return get_inode(i).read()[off:off+size]
+    node = get_inode(i)
+    if readahead != None:
+        readahead.access(node, off, size)
+    return node.read_range(off, size)
 
 def write(write_as, i, off, buf):
     """
     Write writes the given bytes into the file at i at the given offset.
     """
+    return write_extents(write_as, i, [(off, buf)])
+
+def write_extents(write_as, i, extents):
+    """
+    Writes each (offset, bytes) extent in the given list into the file at i,
+    in order, and then commits the resulting file as a single new version.
+    Returns the total number of bytes written.
+    """
     if not isinstance(i, I):
         raise TypeError("{} is not an I, is a {}".format(i, type(i)))
     if not isinstance(write_as, User):
@@ -177,25 +193,155 @@ def write(write_as, i, off, buf):
 
     node = get_inode(i)
 
-    # TODO: this is obviously stupid -- should not get rid of blocks that haven't changed
-    bts = node.read()
-
-    # write also allows us to extend a file
-    if off + len(buf) > len(bts):
-        bts = bts[:off] + buf
-    else:
-        bts = bts[:off] + buf + bts[off+len(buf):]
-
-    # update the inode
-    node.blocks = [secfs.store.block.store(bts)]
+    # update the inode; only the chunks covered by the extents change
+    for off, buf in extents:
+        node.write(off, bytes(buf))
     node.mtime = time.time()
-    node.size = len(bts)
 
     # put new hash in tree
     new_hash = secfs.store.block.store(node.bytes())
     secfs.tables.modmap(write_as, i, new_hash)
 
-    return len(buf)
+    return sum(len(buf) for _, buf in extents)
+
+class Readahead:
+    """
+    A Readahead watches the reads made through an open file, and once they
+    turn out to be sequential, prefetches the chunks that the following reads
+    will need into the block cache. The number of chunks read ahead starts
+    small and doubles each time the reader catches up with it, up to window
+    chunks. A read anywhere else cancels the prefetches still in flight.
+    Reads through the same file handle may come from several threads.
+    """
+    # chunks read ahead when a sequential stream is first detected
+    initial = 4
+
+    def __init__(self, window=64):
+        self.max = window
+        self.window = 0
+        # where the next read starts if the reader is sequential; files are
+        # usually read from the start, so a first read at 0 counts
+        self.next = 0
+        # chunks before this index have been prefetched (or read)
+        self.until = 0
+        self.futures = []
+        self.lock = threading.Lock()
+
+    def cancel(self):
+        """
+        Cancels the prefetches that have not been sent yet, and starts over.
+        """
+        with self.lock:
+            self._cancel()
+
+    def _cancel(self):
+        for future in self.futures:
+            future.cancel()
+        self.futures = []
+        self.window = 0
+        self.until = 0
+
+    def access(self, node, off, size):
+        """
+        Records a read of [off:off+size] from the given inode, and issues
+        prefetches if the reader is about to run out of read-ahead chunks.
+        """
+        with self.lock:
+            self._access(node, off, size)
+
+    def _access(self, node, off, size):
+        sequential = off == self.next
+        self.next = off + size
+        if not sequential:
+            self._cancel()
+            return
+
+        end = min(off + size, node.size)
+        if self.max == 0 or off >= end:
+            return
+
+        bs = node.bsize
+        after = (end - 1) // bs + 1
+        if self.until - after > self.window // 2:
+            # still far enough ahead
+            return
+
+        # never read ahead more than half the cache could hold, or the
+        # prefetched chunks would evict each other before they are read
+        limit = secfs.store.block.cache_capacity // (2 * bs)
+        self.window = min(self.max, limit, max(self.initial, self.window * 2))
+
+        blocks = node.blocks
+        start = max(self.until, after)
+        stop = min(after + self.window, len(blocks))
+        if start >= stop:
+            return
+
+        self.futures = [f for f in self.futures if not f.done()]
+        self.futures.extend(secfs.store.block.prefetch([c for c in blocks[start:stop] if c != None]))
+        secfs.metrics.count("readahead.chunks", stop - start)
+        self.until = stop
+
+class WriteBuffer:
+    """
+    A WriteBuffer accumulates writes to a file so that they can later be
+    committed together using write_extents. Overlapping and adjacent writes
+    are coalesced into a single extent, with later writes taking precedence.
+    Threads sharing a buffer should hold its lock while adding to and
+    committing it; the lock is reentrant, so that a write can trigger a
+    commit.
+    """
+    def __init__(self):
+        self.extents = [
+            # [offset, bytearray], sorted by offset and non-overlapping
+        ]
+        self.size = 0
+        # the end of the furthest buffered write, which is how large the file
+        # will be at least once the buffer is committed
+        self.end = 0
+        # when the buffer first became dirty
+        self.since = None
+        self.lock = threading.RLock()
+
+    def add(self, off, buf):
+        if self.since == None:
+            self.since = time.time()
+        self.end = max(self.end, off + len(buf))
+
+        # fast path: sequential writes extend the last extent
+        if len(self.extents) != 0:
+            last = self.extents[-1]
+            if last[0] + len(last[1]) == off:
+                last[1] += buf
+                self.size += len(buf)
+                return
+
+        end = off + len(buf)
+        data = bytearray(buf)
+        keep = []
+        for eoff, edata in self.extents:
+            eend = eoff + len(edata)
+            if eend < off or eoff > end:
+                keep.append([eoff, edata])
+                continue
+
+            # merge the overlapping extent, letting the new bytes win
+            noff = min(eoff, off)
+            merged = bytearray(max(eend, end) - noff)
+            merged[eoff-noff:eend-noff] = edata
+            merged[off-noff:end-noff] = data
+            off, end, data = noff, noff + len(merged), merged
+
+        keep.append([off, data])
+        keep.sort(key=lambda e: e[0])
+        self.extents = keep
+        self.size = sum(len(e[1]) for e in keep)
+
+    def clear(self):
+        self.extents = []
+        self.size = 0
+        self.end = 0
+        self.since = None
 
 def readdir(i, off):
     """
@@ -209,6 +355,22 @@ def readdir(i, off):
 
     return [(i, index+1) for index, i in enumerate(dr.children) if index >= off]
 
+def readdir_attrs(i, off):
+    """
+    Like readdir, but also loads the inode of every returned entry, fetching
+    all of them in a single batch. Each returned list item is a tuple of the
+    entry's name, its i, its Inode (None if the i does not resolve), and an
+    index as for readdir.
+    """
+    entries = readdir(i, off)
+    if entries == None:
+        return None
+
+    ihashes = [secfs.tables.resolve(e[1]) for e, _ in entries]
+    loaded = iter(Inode.load_many([ihash for ihash in ihashes if ihash != None]))
+    nodes = [next(loaded) if ihash != None else None for ihash in ihashes]
+    return [(e[0], e[1], n, index) for (e, index), n in zip(entries, nodes)]
+
 def link(link_as, i, parent_i, name):
     """
     Adds the given i into the given parent directory under the given name.
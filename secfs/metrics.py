@@ -0,0 +1,130 @@
+# This file implements the client's metrics: call counts and latency
+# histograms for FUSE operations and block RPCs, counters for the bytes moved
+# and the time spent waiting for the server lock, and gauges for values that
+# other modules already keep, such as cache hit counts.
+#
+# Recording a metric costs a dictionary lookup and a few additions under a
+# lock, so metrics are always collected. report() formats them as text, which
+# secfs-fuse periodically writes to a file when asked to.
+
+import time
+import threading
+import functools
+
+class Histogram:
+    """
+    A Histogram counts observed durations in power-of-two buckets of
+    microseconds: bucket k holds durations shorter than 2^k us (and at least
+    2^(k-1) us). It also keeps the number, sum and maximum of the durations.
+    """
+    nbuckets = 32
+
+    def __init__(self):
+        self.buckets = [0] * self.nbuckets
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        k = min(int(seconds * 1000000).bit_length(), self.nbuckets - 1)
+        self.buckets[k] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def quantile(self, q):
+        """
+        Returns an upper bound on the q-quantile of the observed durations,
+        in seconds.
+        """
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for k, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank:
+                return min(self.max, (1 << k) / 1000000)
+        return self.max
+
+# guards counters and histograms, which are updated from the FUSE thread as
+# well as the block request threads
+lock = threading.Lock()
+counters = {
+    # name => int
+}
+histograms = {
+    # name => Histogram
+}
+gauges = {
+    # name => function returning the current value
+}
+
+def count(name, n=1):
+    """
+    Adds n to the named counter.
+    """
+    with lock:
+        counters[name] = counters.get(name, 0) + n
+
+def observe(name, seconds):
+    """
+    Records a duration in the named histogram.
+    """
+    with lock:
+        h = histograms.get(name)
+        if h is None:
+            h = histograms[name] = Histogram()
+        h.observe(seconds)
+
+def gauge(name, f):
+    """
+    Registers f to be called for the value of the named gauge on every
+    report.
+    """
+    gauges[name] = f
+
+def timed(name):
+    """
+    Decorates a function so that the duration of each of its calls is
+    recorded in the named histogram, including calls that raise.
+    """
+    def decorate(f):
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return f(*args, **kwargs)
+            finally:
+                observe(name, time.perf_counter() - start)
+        return wrapper
+    return decorate
+
+def reset():
+    """
+    Forgets all counters and histograms. Gauges are kept.
+    """
+    with lock:
+        counters.clear()
+        histograms.clear()
+
+def report():
+    """
+    Returns the current metrics as text, one metric per line. Durations are
+    given in milliseconds.
+    """
+    with lock:
+        cs = sorted(counters.items())
+        hs = sorted((name, h.count, h.total, h.quantile(0.5), h.quantile(0.99), h.max)
+                for name, h in histograms.items())
+
+    lines = []
+    for name, value in cs:
+        lines.append("{} {}".format(name, value))
+    for name, f in sorted(gauges.items()):
+        lines.append("{} {}".format(name, f()))
+    for name, n, total, p50, p99, worst in hs:
+        lines.append("{} count={} total={:.3f} p50={:.3f} p99={:.3f} max={:.3f}".format(
+            name, n, total * 1000, p50 * 1000, p99 * 1000, worst * 1000))
+    return "\n".join(lines) + "\n"
@@ -1,28 +1,443 @@
 # This file handles all interaction with the SecFS server's blob storage.
 
-# a server connection handle is passed to us at mount time by secfs-fuse
+import time
+import Pyro4
+import hashlib
+import threading
+import secfs.metrics
+import secfs.store.pipeline
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+
+# serializer is the Pyro serializer used for block traffic. Pyro's default
+# (serpent) base64 encodes every binary blob, which inflates each block by a
+# third and costs an extra copy on both ends. marshal sends bytes as-is. Set
+# it to None to share the connection (and serializer) passed to register().
+serializer = "marshal"
+
+# Requests are issued by a pool of worker threads, each with its own
+# connection to the server (and to every shard), so that up to connections
+# requests per server can be in flight at the same time. Large batches are
+# split up over several requests, and callers can start loads and stores
+# without waiting for them to finish using load_async and store_async.
+connections = 4
+rpc_pool = None
+rpc_pool_lock = threading.Lock()
+_local = threading.local()
+
+# the block server is given to us at mount time by secfs-fuse. it is kept as
+# a URI, so that every thread can open its own connection to it. objects that
+# are not Pyro proxies are used directly.
 server = None
+
+# If the server spreads its blocks over several shard servers, shards holds
+# the URI of each of them, and every block is sent to and read from the shard
+# that the first SHARD_PREFIX hex digits of its hash map to.
+shards = []
+SHARD_PREFIX = 8
+
+def _connect(uri):
+    proxy = Pyro4.Proxy(uri)
+    if serializer is not None:
+        # block RPCs only ever carry bytes, strings and lists thereof, so they
+        # can go over a separate connection using a binary-safe serializer
+        proxy._pyroSerializer = serializer
+    return proxy
+
+def _proxy(target):
+    """
+    Returns the calling thread's connection to the given server.
+    """
+    if not isinstance(target, str):
+        return target
+    proxies = getattr(_local, "proxies", None)
+    if proxies is None:
+        proxies = _local.proxies = {}
+    if target not in proxies:
+        proxies[target] = _connect(target)
+    return proxies[target]
+
 def register(_server):
     global server
+    global shards
     server = _server
+    shards = []
+    set_connections(connections)
+
+    if isinstance(_server, Pyro4.Proxy):
+        try:
+            shards = _server.shards()
+        except AttributeError:
+            # the server does not know about shards
+            shards = []
+        server = _server._pyroUri.asString()
+        if serializer is None:
+            # share the connection (and serializer) we were given
+            _local.proxies = {server: _server}
+
+def set_connections(n):
+    """
+    Change the number of requests that may be in flight to each server.
+    """
+    global connections
+    global rpc_pool
+    connections = max(1, n)
+    if rpc_pool is not None:
+        rpc_pool.shutdown()
+        rpc_pool = None
+
+def _size(x):
+    """
+    Returns roughly how many bytes an RPC argument or result takes up.
+    """
+    if isinstance(x, (bytes, bytearray, memoryview, str)):
+        return len(x)
+    if isinstance(x, (list, tuple)):
+        return sum(_size(y) for y in x)
+    if isinstance(x, dict):
+        return len(x.get("data", ""))
+    return 0
+
+def _call(target, method, arg):
+    start = time.perf_counter()
+    ret = getattr(_proxy(target), method)(arg)
+    secfs.metrics.observe("rpc." + method, time.perf_counter() - start)
+    secfs.metrics.count("rpc.bytes_sent", _size(arg))
+    secfs.metrics.count("rpc.bytes_received", _size(ret))
+    return ret
+
+def _submit(f, *args):
+    """
+    Runs f on the request pool, and returns a future for its result.
+    """
+    global rpc_pool
+    with rpc_pool_lock:
+        if rpc_pool is None:
+            rpc_pool = ThreadPoolExecutor(max_workers=connections * max(1, len(shards)),
+                    thread_name_prefix="secfs-rpc")
+        pool = rpc_pool
+    return pool.submit(f, *args)
+
+def shard_for(chash):
+    """
+    Returns the index of the shard that holds the block with the given hash.
+    """
+    return int(chash[:SHARD_PREFIX], 16) % len(shards)
+
+def _target(chash):
+    if len(shards) == 0:
+        return server
+    return shards[shard_for(chash)]
+
+def _fan_out_async(method, chashes, args):
+    """
+    Issues the given batched RPC for all of args (where args[n] is, or is for,
+    the block with hash chashes[n]), split into several requests to each
+    server so that they are processed and transferred concurrently. Returns a
+    list of (positions in args, future) pairs, one for each request.
+    """
+    groups = {}
+    for n, chash in enumerate(chashes):
+        groups.setdefault(_target(chash), []).append(n)
+
+    parts = []
+    for target, ns in groups.items():
+        size = -(-len(ns) // connections)
+        for k in range(0, len(ns), size):
+            part = ns[k:k+size]
+            parts.append((part, _submit(_call, target, method, [args[n] for n in part])))
+    return parts
+
+def _fan_out(method, chashes, args):
+    """
+    Like _fan_out_async, but waits for all the requests, and returns their
+    results in the same order as args.
+    """
+    results = [None] * len(args)
+    for part, future in _fan_out_async(method, chashes, args):
+        for n, r in zip(part, future.result()):
+            results[n] = r
+    return results
+
+# Blocks are immutable and named by the SHA-224 of their contents, so we can
+# keep recently used blocks around locally without ever having to invalidate
+# them. The cache is bounded by the total number of bytes it holds, and evicts
+# the least recently used blocks first.
+cache = OrderedDict()
+cache_size = 0
+cache_capacity = 64 * 1024 * 1024
+cache_hits = 0
+cache_misses = 0
+# guards the cache and inflight, which request threads update too
+cache_lock = threading.Lock()
+
+# stores and prefetches that have been issued but have not completed yet.
+# loads of these blocks wait for them rather than fetching the blocks again, as
+# a store may go over a different connection than the load. stored blocks are
+# only cached once the server has them, so that a failed store is not hidden
+# by the cache.
+inflight = {
+    # chash => future
+}
+
+def set_cache_capacity(capacity):
+    """
+    Change the maximum number of bytes held by the block cache. A capacity of
+    0 disables caching.
+    """
+    global cache_capacity
+    with cache_lock:
+        cache_capacity = capacity
+        _cache_evict()
+
+def _cache_evict():
+    global cache_size
+    while cache_size > cache_capacity:
+        _, blob = cache.popitem(last=False)
+        cache_size -= len(blob)
+
+def _hash(blob):
+    return hashlib.sha224(blob).hexdigest()
+
+def _cache_put(chash, blob, digest=None):
+    """
+    Add the given blob to the cache, but only if it really has the given hash.
+    If the blob's hash has already been computed, it can be passed as digest.
+    """
+    global cache_size
+    if len(blob) > cache_capacity or chash in cache:
+        return
+    if digest is None:
+        digest = _hash(blob)
+    if digest != chash:
+        return
+
+    with cache_lock:
+        if chash in cache:
+            return
+        cache[chash] = blob
+        cache_size += len(blob)
+        _cache_evict()
+
+secfs.metrics.gauge("block.cache.hits", lambda: cache_hits)
+secfs.metrics.gauge("block.cache.misses", lambda: cache_misses)
+secfs.metrics.gauge("block.cache.bytes", lambda: cache_size)
+
+def _cache_get(chash):
+    global cache_hits
+    global cache_misses
+    with cache_lock:
+        if chash in cache:
+            cache.move_to_end(chash)
+            cache_hits += 1
+            return cache[chash]
+        cache_misses += 1
+        return None
+
+def _decode(blob):
+    """
+    Undo any encoding the RPC layer applied to a blob returned by the server.
+    """
+    # serpent will base64 encode binary data
+    if isinstance(blob, dict):
+        import base64
+        blob = base64.b64decode(blob["data"])
+    return blob
+
+def _wait_inflight(chashes):
+    """
+    Waits for any stores or prefetches of the given blocks that are still in
+    flight, and returns the blocks that are now in the cache. Failed requests
+    are ignored here; the blocks will simply be fetched again. This must not be
+    called from the request pool, as the requests waited for may be queued
+    behind the caller.
+    """
+    with cache_lock:
+        futures = set(inflight[chash] for chash in chashes if chash in inflight)
+    if len(futures) > 0:
+        wait(futures)
+    with cache_lock:
+        return {chash: cache[chash] for chash in chashes if chash in cache}
+
+def _store(digest, blob):
+    chash = _call(_target(digest), "store", blob)
+    if chash != digest:
+        raise ValueError("server stored block with hash {} as {}".format(digest, chash))
+    return chash
+
+def store_async(blob):
+    """
+    Starts storing the given blob at the server, and returns a future for its
+    content hash. Since blocks are named by their contents, the hash is known
+    right away, and is also available as the future's chash attribute.
+    """
+    digest = _hash(blob)
+    future = _submit(_store, digest, blob)
+    future.chash = digest
+    with cache_lock:
+        inflight[digest] = future
+
+    def done(f):
+        if not f.cancelled() and f.exception() is None:
+            _cache_put(digest, blob, digest)
+        with cache_lock:
+            if inflight.get(digest) is f:
+                del inflight[digest]
+    future.add_done_callback(done)
+    return future
+
+def store_many_async(blobs):
+    """
+    Starts storing all the given blobs at the server, and returns a future
+    for the list of their content hashes, which is also available right away
+    as the future's chashes attribute.
+    """
+    digests = secfs.store.pipeline.map(_hash, blobs)
+    parts = _fan_out_async("store_many", digests, blobs)
+    with cache_lock:
+        for part, future in parts:
+            for n in part:
+                inflight[digests[n]] = future
+
+    combined = Future()
+    combined.chashes = digests
+    remaining = [len(parts)]
+    def done(f):
+        if not f.cancelled() and f.exception() is None:
+            for part, future in parts:
+                if future is f:
+                    for n, chash in zip(part, f.result()):
+                        if chash == digests[n]:
+                            _cache_put(chash, blobs[n], chash)
+        with cache_lock:
+            for part, future in parts:
+                if future is f:
+                    for n in part:
+                        if inflight.get(digests[n]) is f:
+                            del inflight[digests[n]]
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if not last:
+            return
+        for part, future in parts:
+            if future.exception() is not None:
+                combined.set_exception(future.exception())
+                return
+            for n, chash in zip(part, future.result()):
+                if chash != digests[n]:
+                    combined.set_exception(ValueError("server stored block with hash {} as {}".format(digests[n], chash)))
+                    return
+        combined.set_result(digests)
+
+    if len(parts) == 0:
+        combined.set_result([])
+    for _, future in parts:
+        future.add_done_callback(done)
+    return combined
 
 def store(blob):
     """
     Store the given blob at the server, and return the content's hash.
     """
-    global server
-    return server.store(blob)
+    digest = _hash(blob)
+    chash = _store(digest, blob)
+    _cache_put(digest, blob, digest)
+    return chash
+
+def store_many(blobs):
+    """
+    Store all the given blobs at the server, and return a list of their
+    content hashes. Large batches are split over several concurrent requests.
+    """
+    return store_many_async(blobs).result()
+
+def _fetch(chash):
+    blob = _decode(_call(_target(chash), "read", chash))
+    if blob is None:
+        return None
+
+    _cache_put(chash, blob)
+    return blob
+
+def load_async(chash):
+    """
+    Starts loading the blob with the given content hash, and returns a future
+    for it.
+    """
+    blob = _cache_get(chash)
+    if blob is None:
+        blob = _wait_inflight([chash]).get(chash)
+    if blob is not None:
+        future = Future()
+        future.set_result(blob)
+        return future
+    return _submit(_fetch, chash)
 
 def load(chash):
     """
     Load the blob with the given content hash from the server.
     """
-    global server
-    blob = server.read(chash)
+    blob = _cache_get(chash)
+    if blob is None:
+        blob = _wait_inflight([chash]).get(chash)
+    if blob is not None:
+        return blob
+    return _fetch(chash)
 
-    # the RPC layer will base64 encode binary data
-    if "data" in blob:
-        import base64
-        blob = base64.b64decode(blob["data"])
+def load_many(chashes):
+    """
+    Load the blobs with the given content hashes, and return them as a list in
+    the same order. Blobs that are not in the cache are fetched from the
+    server using a few concurrent batched requests.
+    """
+    blobs = [_cache_get(chash) for chash in chashes]
+    missing = list(dict.fromkeys([chash for chash, blob in zip(chashes, blobs) if blob is None]))
+    if len(missing) == 0:
+        return blobs
 
-    return blob
+    fetched = _wait_inflight(missing)
+    missing = [chash for chash in missing if chash not in fetched]
+    if len(missing) > 0:
+        fetched.update(zip(missing, [_decode(blob) for blob in _fan_out("read_many", missing, missing)]))
+
+    # check the hashes of the fetched blobs in parallel before caching them
+    present = [(chash, fetched[chash]) for chash in missing if fetched[chash] is not None]
+    digests = secfs.store.pipeline.map(_hash, [blob for _, blob in present])
+    for (chash, blob), digest in zip(present, digests):
+        _cache_put(chash, blob, digest)
+
+    return [fetched[chash] if blob is None else blob for chash, blob in zip(chashes, blobs)]
+
+def prefetch(chashes):
+    """
+    Starts loading the given blocks into the cache in the background, skipping
+    those that are already cached or on their way. Returns futures for the
+    requests that were issued, which may be cancelled if the blocks turn out
+    not to be needed after all.
+    """
+    with cache_lock:
+        wanted = [chash for chash in dict.fromkeys(chashes) if chash not in cache and chash not in inflight]
+    if len(wanted) == 0:
+        return []
+
+    parts = _fan_out_async("read_many", wanted, wanted)
+    with cache_lock:
+        for part, future in parts:
+            for n in part:
+                inflight[wanted[n]] = future
+
+    def done(part, f):
+        blobs = []
+        if not f.cancelled() and f.exception() is None:
+            blobs = [_decode(blob) for blob in f.result()]
+        for n, blob in zip(part, blobs):
+            if blob is not None:
+                _cache_put(wanted[n], blob)
+        with cache_lock:
+            for n in part:
+                if inflight.get(wanted[n]) is f:
+                    del inflight[wanted[n]]
+
+    for part, future in parts:
+        future.add_done_callback(lambda f, part=part: done(part, f))
+    return [future for _, future in parts]
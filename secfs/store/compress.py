@@ -0,0 +1,104 @@
+# This file implements the compression of file contents before they are
+# stored.
+#
+# Every chunk of a (new) file is stored with a header byte naming the codec it
+# was compressed with, so that chunks written by mounts using different codecs
+# (or none at all) can be read by any client. Compression happens before any
+# other transform, as encrypted chunks no longer compress. Chunks that do not
+# compress well, such as media or already compressed files, are detected by
+# compressing a small sample first, and are stored as they are.
+#
+# The header byte means that a chunk stored as it is still has to be copied
+# once behind it. Callers can avoid copying it out of a larger buffer first by
+# passing a memoryview, and decompress() hands back a view of the stored
+# block rather than another copy.
+
+import zlib
+import lzma
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# header bytes
+STORED = 0
+ZLIB = 1
+LZMA = 2
+ZSTD = 3
+
+# the codec new chunks are compressed with; None stores chunks uncompressed
+codec = None
+
+# chunks whose sample does not shrink below this fraction of its size are
+# assumed to be incompressible
+SAMPLE_SIZE = 4096
+SAMPLE_RATIO = 0.9
+
+def _zstd_compress(data):
+    return zstandard.ZstdCompressor(level=3).compress(data)
+
+def _zstd_decompress(data):
+    return zstandard.ZstdDecompressor().decompress(data)
+
+codecs = {
+    # name => (header byte, compress, decompress)
+    "zlib": (ZLIB, lambda d: zlib.compress(d, 6), zlib.decompress),
+    "lzma": (LZMA, lambda d: lzma.compress(d, preset=1), lzma.decompress),
+}
+if zstandard is not None:
+    codecs["zstd"] = (ZSTD, _zstd_compress, _zstd_decompress)
+
+decompressors = {header: dec for header, _, dec in codecs.values()}
+
+def set_codec(name):
+    """
+    Selects the codec that chunks are compressed with from now on, by name.
+    "none" turns compression off.
+    """
+    global codec
+    if name == None or name == "none":
+        codec = None
+        return
+    if name not in codecs:
+        raise ValueError("unknown or unavailable codec {}; available are {}".format(
+            name, ", ".join(["none"] + sorted(codecs))))
+    codec = name
+
+def compressible(data):
+    """
+    Guesses whether data is worth compressing, by compressing a sample of it.
+    """
+    if len(data) <= SAMPLE_SIZE:
+        return True
+    mid = (len(data) - SAMPLE_SIZE) // 2
+    sample = data[mid:mid+SAMPLE_SIZE]
+    return len(zlib.compress(sample, 1)) < SAMPLE_RATIO * len(sample)
+
+def compress(data, name=None):
+    """
+    Compresses data (any bytes-like object) with the named codec (or the
+    currently selected one), and returns it prefixed by the header byte for
+    the codec that was used.
+    """
+    if name == None:
+        name = codec
+    if name != None and compressible(data):
+        header, enc, _ = codecs[name]
+        out = enc(data)
+        if len(out) < len(data):
+            return bytes([header]) + out
+    return bytes([STORED]) + data
+
+def decompress(blob):
+    """
+    Undoes compress(). Chunks that were stored as they are are returned as a
+    memoryview into blob.
+    """
+    header = blob[0]
+    data = memoryview(blob)[1:]
+    if header == STORED:
+        return data
+    if header not in decompressors:
+        raise ValueError("chunk compressed with unknown or unavailable codec {}".format(header))
+    return decompressors[header](data)
@@ -0,0 +1,225 @@
+# This file implements the SecFS server's garbage collector.
+#
+# Blocks are immutable and content-addressed, so every change to the file
+# system stores new blocks, and leaves older ones behind. A block is live if it
+# can be reached from one of the current itables, which clients publish to the
+# server: itables refer to itable chunks, chunks refer to inodes, and inodes
+# refer to file contents and directory buckets. Directory entries and group
+# itable entries are is rather than block hashes, and are reached through the
+# itables themselves, so they need not be followed.
+#
+# A collection first marks every live block, and then sweeps away every block
+# that was not marked. Both phases run in short slices, each holding the
+# server lock only briefly, so that clients can make progress in between.
+# Itables published while a collection is in progress are marked as well, and
+# blocks stored within the last grace seconds (or since the collection began)
+# are never swept, as a client may have stored them without having published
+# the itable that refers to them yet.
+
+import time
+import logging
+import threading
+
+import secfs.tables
+from secfs.store.inode import Inode
+
+log = logging.getLogger(__name__)
+
+# the kinds of blocks the collector knows how to trace through
+ITABLE = 0
+CHUNK = 1
+INODE = 2
+LEAF = 3
+
+def references(blob, kind):
+    """
+    Returns the (chash, kind) pairs for the blocks referred to by the given
+    block of the given kind.
+    """
+    if kind == ITABLE:
+        _, chashes = secfs.tables._unpack_itable(blob)
+        return [(chash, CHUNK) for chash in chashes if chash != None]
+    if kind == CHUNK:
+        # group chunks map to is rather than inodes
+        return [(ihash.hex() if isinstance(ihash, bytes) else ihash, INODE)
+                for ihash in secfs.tables._unpack_chunk(blob).values()
+                if not isinstance(ihash, secfs.tables.I)]
+    if kind == INODE:
+        return [(chash, LEAF) for chash in Inode.from_bytes(blob).blocks if chash != None]
+    return []
+
+class Collector:
+    """
+    An incremental mark-and-sweep collector for the blocks of the given
+    SecFSRPC server. Slices of work take the server lock through the given
+    lock functions, and last at most slice seconds each.
+    """
+    def __init__(self, server, lock, unlock, lock_shared, unlock_shared, grace=60, slice=0.01):
+        self.server = server
+        self.lock = lock
+        self.unlock = unlock
+        self.lock_shared = lock_shared
+        self.unlock_shared = unlock_shared
+        self.grace = grace
+        self.slice = slice
+
+        # guards touched and gray, which are updated by RPC threads
+        self.mutex = threading.Lock()
+        self.touched = {
+            # chash => when it was last stored
+        }
+        self.running = False
+        self.gray = []
+        self.marked = {
+            # chash => size
+        }
+        self.stats = None
+
+    def touch(self, chash):
+        """
+        Records that a block was just stored. A block that is stored again is
+        in use again, even if it was not reachable before.
+        """
+        with self.mutex:
+            self.touched[chash] = time.time()
+
+    def shade(self, ihandle):
+        """
+        Records that a new itable was published, so that a collection in
+        progress marks everything it refers to.
+        """
+        with self.mutex:
+            if self.running:
+                self.gray.append((ihandle, ITABLE))
+
+    def _begin(self):
+        self.lock_shared()
+        try:
+            if len(self.server.itables) == 0:
+                # no client has published its itables, so there is no way to
+                # tell which blocks are live
+                return False
+            with self.mutex:
+                self.start = time.time()
+                cutoff = self.start - self.grace
+                self.touched = {c: t for c, t in self.touched.items() if t >= cutoff}
+                self.gray = [(ihandle, ITABLE) for ihandle in self.server.itables.values()]
+                self.marked = {}
+                self.running = True
+            return True
+        finally:
+            self.unlock_shared()
+
+    def _mark(self):
+        """
+        Marks blocks for one slice. Returns True once there is nothing left
+        to mark.
+        """
+        deadline = time.monotonic() + self.slice
+        blocks = self.server.blocks
+        self.lock_shared()
+        try:
+            while time.monotonic() < deadline:
+                with self.mutex:
+                    if len(self.gray) == 0:
+                        return True
+                    chash, kind = self.gray.pop()
+                if chash in self.marked or chash not in blocks:
+                    continue
+
+                blob = blocks[chash]
+                self.marked[chash] = len(blob)
+                refs = references(blob, kind)
+                with self.mutex:
+                    self.gray.extend(refs)
+            return False
+        finally:
+            self.unlock_shared()
+
+    def _sweep(self, candidates):
+        """
+        Removes unmarked blocks from the end of candidates for one slice.
+        Returns the number of blocks and bytes reclaimed.
+        """
+        deadline = time.monotonic() + self.slice
+        blocks = self.server.blocks
+        nblocks, nbytes = 0, 0
+        self.lock()
+        try:
+            while len(candidates) > 0 and time.monotonic() < deadline:
+                chash = candidates.pop()
+                if chash in self.marked or chash not in blocks:
+                    continue
+                with self.mutex:
+                    if chash in self.touched:
+                        continue
+                nbytes += len(blocks[chash])
+                nblocks += 1
+                del blocks[chash]
+        finally:
+            self.unlock()
+        return nblocks, nbytes
+
+    def collect(self):
+        """
+        Runs a full collection, and returns statistics about it. Returns None
+        if no itables have been published yet.
+        """
+        if not self._begin():
+            return None
+
+        try:
+            while not self._mark():
+                pass
+
+            # blocks stored from here on are in touched, so a snapshot of the
+            # block store contains every block that may be swept
+            self.lock_shared()
+            try:
+                candidates = list(self.server.blocks)
+            finally:
+                self.unlock_shared()
+
+            stats = {
+                "live_blocks": len(self.marked),
+                "live_bytes": sum(self.marked.values()),
+                "reclaimed_blocks": 0,
+                "reclaimed_bytes": 0,
+            }
+            while True:
+                # itables published between slices must be marked before
+                # anything is swept
+                while not self._mark():
+                    pass
+                if len(candidates) == 0:
+                    break
+                nblocks, nbytes = self._sweep(candidates)
+                stats["reclaimed_blocks"] += nblocks
+                stats["reclaimed_bytes"] += nbytes
+
+            stats["live_blocks"] = len(self.marked)
+            stats["live_bytes"] = sum(self.marked.values())
+            stats["seconds"] = time.time() - self.start
+        finally:
+            with self.mutex:
+                self.running = False
+                self.gray = []
+            self.marked = {}
+
+        self.stats = stats
+        return stats
+
+    def run(self, interval):
+        """
+        Runs a collection every interval seconds, forever.
+        """
+        while True:
+            time.sleep(interval)
+            try:
+                stats = self.collect()
+            except Exception as e:
+                # never sweep on a partial mark; try again next time
+                log.warning("gc: collection failed: %s", e)
+                continue
+            if stats != None:
+                log.info("gc: {live_blocks} live blocks ({live_bytes} bytes), reclaimed {reclaimed_blocks} blocks ({reclaimed_bytes} bytes) in {seconds:.2f}s".format(**stats))
@@ -1,7 +1,56 @@
 import pickle
+import struct
 import secfs.store.block
+import secfs.store.pipeline
+import secfs.store.compress
 import secfs.crypto
 
+# file contents are split into chunks of BLOCK_SIZE bytes, so that a write
+# only has to re-store the chunks it actually touches. every chunk except for
+# the last one is exactly an inode's bsize bytes long.
+BLOCK_SIZE = 64 * 1024
+
+# transforms are applied, in order, to each chunk of file contents before it is
+# stored, and undone in reverse order after it is loaded. each is a pair of
+# functions (encode, decode) that take the inode, the index of the chunk in the
+# file, and the chunk, and return the transformed chunk. chunks are
+# transformed on the block pipeline, so these may be called concurrently.
+transforms = []
+
+# the bits of an inode's flags byte. chunks of framed inodes start with a
+# secfs.store.compress header; inodes created before that was the case are
+# not framed, and their contents are never compressed. directories are never
+# framed either, as secfs.store.tree stores their buckets as they are.
+FLAG_EX = 0x01
+FLAG_FRAMED = 0x02
+
+# Inodes are serialized as a version byte, a fixed header, the two timestamps,
+# and the raw hashes of their blocks, followed by a pickle of any attributes
+# beyond the ones below (which is empty unless something has added attributes
+# to the inode). Inodes serialized as a plain pickle are still understood.
+#
+# Turning raw hashes back into hex strings dominates the cost of decoding a
+# large inode, and most inodes that are loaded (e.g., by getattr or readdir)
+# never have their blocks looked at. The raw hashes are therefore kept as they
+# are until the blocks are first accessed.
+INODE_VERSION = 1
+INODE_HEADER = struct.Struct(">BBBQII") # version, kind, flags, size, bsize, #blocks
+INODE_FIELDS = ("size", "kind", "ex", "framed", "ctime", "mtime", "bsize", "_blocks", "_raw_blocks", "_pending")
+# timestamps are either float seconds or integer nanoseconds (from setattr)
+TIME_FLOAT = struct.Struct(">Bd")
+TIME_INT = struct.Struct(">Bq")
+HASH_SIZE = 28
+
+def _pack_time(t):
+    if isinstance(t, int):
+        return TIME_INT.pack(1, t)
+    return TIME_FLOAT.pack(0, t)
+
+def _unpack_time(d, off):
+    if d[off] == 1:
+        return TIME_INT.unpack_from(d, off)[1], off + TIME_INT.size
+    return TIME_FLOAT.unpack_from(d, off)[1], off + TIME_FLOAT.size
+
 class Inode:
     def __init__(self):
         self.size = 0
@@ -9,8 +58,28 @@ class Inode:
         self.ex = False
         self.ctime = 0
         self.mtime = 0
+        self.bsize = BLOCK_SIZE
+        # whether chunks start with a secfs.store.compress header
+        self.framed = True
+        self._raw_blocks = None
+        # stores of written chunks that may still be in flight
+        self._pending = []
         self.blocks = []
 
+    @property
+    def blocks(self):
+        if self._raw_blocks is not None:
+            # converting all hashes at once is much faster than one at a time
+            hexed = self._raw_blocks.hex()
+            self._blocks = [hexed[k:k+2*HASH_SIZE] for k in range(0, len(hexed), 2*HASH_SIZE)]
+            self._raw_blocks = None
+        return self._blocks
+
+    @blocks.setter
+    def blocks(self, blocks):
+        self._raw_blocks = None
+        self._blocks = blocks
+
     @staticmethod
     def load(ihash):
         """
@@ -20,19 +89,164 @@ class Inode:
         if d == None:
             return None
 
+        return Inode.from_bytes(d)
+
+    @staticmethod
+    def load_many(ihashes):
+        """
+        Loads the inodes with the given ihandles using a single batched block
+        request, and returns them as a list in the same order.
+        """
+        return [
+            Inode.from_bytes(d) if d != None else None
+            for d in secfs.store.block.load_many(ihashes)
+        ]
+
+    @staticmethod
+    def from_bytes(d):
+        """
+        Deserialize an inode from the bytestring produced by Inode.bytes().
+        """
         n = Inode()
-        n.__dict__.update(pickle.loads(d))
+        n.framed = False
+        if d[0] != INODE_VERSION:
+            # inodes used to be pickled dicts
+            state = pickle.loads(d)
+            n.blocks = state.pop("blocks")
+            n.__dict__.update(state)
+            if "bsize" not in state:
+                # from before files were chunked, when all of a file was
+                # kept in a single block
+                n.bsize = max(n.size, BLOCK_SIZE)
+            return n
+
+        _, n.kind, flags, n.size, n.bsize, nblocks = INODE_HEADER.unpack_from(d)
+        n.ex = flags & FLAG_EX != 0
+        n.framed = flags & FLAG_FRAMED != 0 and n.kind != 0
+        off = INODE_HEADER.size
+        n.ctime, off = _unpack_time(d, off)
+        n.mtime, off = _unpack_time(d, off)
+
+        n._raw_blocks = bytes(d[off:off+nblocks*HASH_SIZE])
+        off += nblocks * HASH_SIZE
+
+        if off < len(d):
+            n.__dict__.update(pickle.loads(d[off:]))
         return n
 
+    def _encode(self, first, chunks):
+        """
+        Compresses the given chunks, the first of which is at chunk index
+        first, and then applies all transforms to them.
+        """
+        if not self.framed and len(transforms) == 0:
+            return chunks
+
+        def encode(chunk, index):
+            if self.framed:
+                chunk = secfs.store.compress.compress(chunk)
+            for enc, _ in transforms:
+                chunk = enc(self, index, chunk)
+            return chunk
+        return secfs.store.pipeline.map(encode, chunks, range(first, first + len(chunks)))
+
+    def _load_chunks(self, first, last):
+        """
+        Loads chunks first through last (inclusive), undoes all transforms, and
+        decompresses them.
+        """
+        chunks = secfs.store.block.load_many(self.blocks[first:last+1])
+        if not self.framed and len(transforms) == 0:
+            return chunks
+
+        def decode(chunk, index):
+            for _, dec in reversed(transforms):
+                chunk = dec(self, index, chunk)
+            if self.framed:
+                chunk = secfs.store.compress.decompress(chunk)
+            return chunk
+        return secfs.store.pipeline.map(decode, chunks, range(first, first + len(chunks)))
+
     def read(self):
         """
         Reads the block content of this inode.
         """
-        return b"".join([secfs.store.block.load(b) for b in self.blocks])
+        return b"".join(self._load_chunks(0, len(self.blocks) - 1))
+
+    def read_range(self, off, size):
+        """
+        Reads [off:off+size] of the block content of this inode, only loading
+        the chunks that overlap the requested range.
+        """
+        end = min(off + size, self.size)
+        if off >= end:
+            return b""
+
+        bs = self.bsize
+        first = off // bs
+        last = (end - 1) // bs
+        start = first * bs
+
+        data = b"".join(self._load_chunks(first, last))
+        return data[off-start:end-start]
+
+    def write(self, off, buf):
+        """
+        Writes buf into the contents of this inode at the given offset,
+        extending the file (with zeroes if off is past the end) as necessary.
+        Only the chunks overlapping the written range are loaded and
+        re-stored; the caller is responsible for storing the updated inode.
+        The chunks are stored asynchronously, so that the chunks of several
+        writes are in flight at once; bytes() waits for them.
+        """
+        if len(buf) == 0:
+            return
+
+        bs = self.bsize
+        end = off + len(buf)
+
+        # if we are writing past the end of the file, the current last chunk
+        # (and the gap up to off) also needs to be rewritten
+        first = min(off, self.size) // bs
+        last = (end - 1) // bs
+        start = first * bs
+
+        old = b"".join(self._load_chunks(first, last))
+        if off - start > len(old):
+            old += bytes(off - start - len(old))
+        data = old[:off-start] + buf + old[end-start:]
+
+        if self.framed:
+            # compress() copies each chunk behind its header byte, so it need
+            # not be copied out of data first
+            data = memoryview(data)
+        chunks = [data[k:k+bs] for k in range(0, len(data), bs)]
+        future = secfs.store.block.store_many_async(self._encode(first, chunks))
+        self.blocks[first:last+1] = future.chashes
+        self._pending.append(future)
+        self.size = max(self.size, end)
 
     def bytes(self):
         """
-        Serialize this inode and return the corresponding bytestring.
+        Serialize this inode and return the corresponding bytestring. Waits
+        until all chunks written so far have been stored, so that the inode is
+        never stored before the chunks it refers to.
         """
-        b = self.__dict__
-        return pickle.dumps(b)
+        for future in self._pending:
+            future.result()
+        self._pending = []
+
+        extra = {k: v for k, v in self.__dict__.items() if k not in INODE_FIELDS}
+        if self._raw_blocks is not None:
+            raw = self._raw_blocks
+        else:
+            raw = bytes.fromhex("".join(self._blocks))
+        return b"".join([
+            INODE_HEADER.pack(INODE_VERSION, self.kind,
+                (FLAG_EX if self.ex else 0) | (FLAG_FRAMED if self.framed and self.kind != 0 else 0),
+                self.size, self.bsize, len(raw) // HASH_SIZE),
+            _pack_time(self.ctime),
+            _pack_time(self.mtime),
+            raw,
+            pickle.dumps(extra) if len(extra) != 0 else b"",
+        ])
@@ -0,0 +1,221 @@
+# This file implements a persistent block store for the SecFS server.
+#
+# Blocks are appended to a single packfile, and never modified in place. Each
+# record in the packfile is a header holding the block's raw SHA-224 and its
+# length, followed by the block itself. A separate index file maps block
+# hashes to packfile offsets. The index is kept sorted so that it can be
+# mmap'd and binary searched directly, without ever being read into memory.
+# Blocks appended since the index was last written are tracked in a small
+# in-memory table, which is folded into the on-disk index once it grows large.
+#
+# On startup, only the tail of the packfile that is not yet covered by the
+# index has to be scanned, so restart time is proportional to the index, not
+# to the amount of data stored.
+
+import os
+import mmap
+import heapq
+import struct
+import threading
+
+# a packfile record header: raw block hash and block length
+RECORD = struct.Struct(">28sI")
+# the index header: magic, number of entries, and how much of the packfile
+# the entries cover
+INDEX_HEADER = struct.Struct(">4sQQ")
+INDEX_MAGIC = b"SFIX"
+# an index entry: raw block hash, offset of block data, and block length
+INDEX_ENTRY = struct.Struct(">28sQI")
+
+# how many recently appended blocks to track in memory before rewriting the
+# on-disk index
+MERGE_THRESHOLD = 64 * 1024
+
+class PackStore:
+    """
+    A PackStore is a persistent, dict-like mapping from hex block hashes to
+    blocks, backed by an append-only packfile and an mmap'd index in the given
+    directory. Blocks returned by a PackStore are memoryviews into the mapped
+    packfile, and so are not copied until they are sent to a client.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._open()
+
+    def _open(self):
+        # the server handles requests on multiple threads
+        self.lock = threading.Lock()
+        os.makedirs(self.path, exist_ok=True)
+        self.pack_path = os.path.join(self.path, "blocks.pack")
+        self.index_path = os.path.join(self.path, "blocks.idx")
+
+        self.pack = open(self.pack_path, "a+b")
+        self.pack_map = None
+        self.index_map = None
+        self.index_count = 0
+        self.indexed_end = 0
+        self.recent = {
+            # raw hash => (offset, length)
+        }
+
+        if os.path.exists(self.index_path):
+            self._map_index()
+        self._scan(self.indexed_end)
+
+    def __getstate__(self):
+        # the server's fork trick snapshots all server state; for a PackStore
+        # it is enough to remember how much of the packfile existed
+        with self.lock:
+            return {"path": self.path, "end": self._end()}
+
+    def __setstate__(self, state):
+        self.path = state["path"]
+        self._open()
+        if self._end() > state["end"]:
+            self._truncate(state["end"])
+
+    def _end(self):
+        self.pack.seek(0, os.SEEK_END)
+        return self.pack.tell()
+
+    def _map_index(self):
+        with open(self.index_path, "rb") as f:
+            magic, count, end = INDEX_HEADER.unpack(f.read(INDEX_HEADER.size))
+            if magic != INDEX_MAGIC:
+                raise ValueError("{} is not a SecFS block index".format(self.index_path))
+            self.index_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if count > 0 else None
+        self.index_count = count
+        self.indexed_end = end
+
+    def _map_pack(self):
+        # mmap cannot map empty files
+        if self._end() > 0:
+            self.pack_map = mmap.mmap(self.pack.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _scan(self, off):
+        """
+        Add all records in the packfile starting at off to the in-memory table.
+        A torn record at the end (from a crash in the middle of an append) is
+        discarded.
+        """
+        end = self._end()
+        while off + RECORD.size <= end:
+            self.pack.seek(off)
+            digest, length = RECORD.unpack(self.pack.read(RECORD.size))
+            if off + RECORD.size + length > end:
+                break
+            self.recent[digest] = (off + RECORD.size, length)
+            off += RECORD.size + length
+
+        if off != end:
+            self.pack.truncate(off)
+
+    def _truncate(self, end):
+        """
+        Discard all blocks appended after the given packfile offset.
+        """
+        self.pack.truncate(end)
+        self.pack_map = None
+        self.recent = {}
+        if self.indexed_end > end:
+            # the index refers to discarded blocks, so start over
+            os.unlink(self.index_path)
+            self.index_map = None
+            self.index_count = 0
+            self.indexed_end = 0
+        self._scan(self.indexed_end)
+
+    def _index_entry(self, n):
+        return INDEX_ENTRY.unpack_from(self.index_map, INDEX_HEADER.size + n * INDEX_ENTRY.size)
+
+    def _lookup(self, digest):
+        if digest in self.recent:
+            return self.recent[digest]
+
+        # binary search the sorted on-disk index
+        lo, hi = 0, self.index_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            d, off, length = self._index_entry(mid)
+            if d == digest:
+                return (off, length)
+            if d < digest:
+                lo = mid + 1
+            else:
+                hi = mid
+        return None
+
+    def _merge(self):
+        """
+        Write a new on-disk index covering all blocks in the packfile, and
+        empty the in-memory table.
+        """
+        old = (self._index_entry(n) for n in range(self.index_count))
+        new = ((d, off, length) for d, (off, length) in sorted(self.recent.items()))
+
+        # the index must never cover blocks that could still be lost
+        os.fsync(self.pack.fileno())
+        tmp = self.index_path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(INDEX_HEADER.pack(INDEX_MAGIC, self.index_count + len(self.recent), self._end()))
+            for e in heapq.merge(old, new):
+                f.write(INDEX_ENTRY.pack(*e))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.index_path)
+
+        self.recent = {}
+        self._map_index()
+
+    def __contains__(self, chash):
+        try:
+            digest = bytes.fromhex(chash)
+        except ValueError:
+            return False
+        with self.lock:
+            return self._lookup(digest) is not None
+
+    def __getitem__(self, chash):
+        try:
+            digest = bytes.fromhex(chash)
+        except ValueError:
+            raise KeyError(chash)
+
+        with self.lock:
+            loc = self._lookup(digest)
+            if loc is None:
+                raise KeyError(chash)
+
+            off, length = loc
+            if self.pack_map is None or off + length > len(self.pack_map):
+                # the packfile has grown since we last mapped it
+                self._map_pack()
+            return memoryview(self.pack_map)[off:off+length]
+
+    def __setitem__(self, chash, blob):
+        digest = bytes.fromhex(chash)
+        with self.lock:
+            if self._lookup(digest) is not None:
+                # blocks are content-addressed, so it must be the same block
+                return
+
+            off = self._end()
+            self.pack.write(RECORD.pack(digest, len(blob)))
+            self.pack.write(blob)
+            self.pack.flush()
+            self.recent[digest] = (off + RECORD.size, len(blob))
+
+            if len(self.recent) >= MERGE_THRESHOLD:
+                self._merge()
+
+    def __len__(self):
+        return self.index_count + len(self.recent)
+
+    def sync(self):
+        """
+        Forces every block appended so far to disk. Blocks are only flushed
+        as they are appended, so anything referring to them, such as the
+        server's roots, must not be saved before they are synced.
+        """
+        with self.lock:
+            os.fsync(self.pack.fileno())
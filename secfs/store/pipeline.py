@@ -0,0 +1,48 @@
+# This file provides a pool of worker threads for preparing blocks in parallel.
+#
+# Hashing, encrypting and compressing blocks is CPU-bound, but hashlib and the
+# cryptography primitives release the GIL while working on large buffers. By
+# spreading the blocks of a large read or write over several threads, all of a
+# client's cores can be put to work, rather than just the one running the FUSE
+# operation.
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# number of worker threads; 1 disables the pool and runs everything inline
+workers = os.cpu_count() or 1
+# batches with fewer bytes than this in total are not worth handing off
+min_bytes = 256 * 1024
+
+pool = None
+pool_lock = threading.Lock()
+
+def set_workers(n):
+    """
+    Change the number of worker threads used to prepare blocks.
+    """
+    global workers
+    global pool
+    workers = max(1, n)
+    if pool is not None:
+        pool.shutdown()
+        pool = None
+
+def map(f, blocks, *args):
+    """
+    Applies f to each of the given blocks (and the corresponding elements of
+    any further lists given, as for the built-in map), and returns the results
+    as a list in the same order. f is applied to different blocks
+    concurrently, so it must not depend on being called in any particular
+    order.
+    """
+    if workers <= 1 or len(blocks) < 2 or sum(len(b) for b in blocks) < min_bytes:
+        return [f(*a) for a in zip(blocks, *args)]
+
+    global pool
+    with pool_lock:
+        if pool is None:
+            pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="secfs-pipeline")
+        p = pool
+    return list(p.map(f, blocks, *args))
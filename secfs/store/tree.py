@@ -1,12 +1,14 @@
 # This file provides functionality for manipulating directories in SecFS.
 
+import zlib
 import pickle
+import struct
 import secfs.fs
 import secfs.crypto
 import secfs.tables
 import secfs.store.block
 from secfs.store.inode import Inode
-from secfs.types import I, Principal, User, Group
+from secfs.types import I, I_STRUCT, Principal, User, Group
 
 def find_under(dir_i, name):
     """
@@ -17,10 +19,64 @@ def find_under(dir_i, name):
         raise TypeError("{} is not an I, is a {}".format(dir_i, type(dir_i)))
 
     dr = Directory(dir_i)
-    for f in dr.children:
-        if f[0] == name:
-            return f[1]
-    return None
+    return dr.find(name)
+
+# Directory entries are spread over a number of buckets using linear hashing,
+# with each bucket stored in its own block. A directory inode's blocks are its
+# buckets. Looking up a name only loads the one bucket the name hashes to, and
+# adding a name only re-stores that bucket (plus, once it grows past
+# BUCKET_ENTRIES, the bucket that is split to make room). A directory with a
+# single bucket has the same layout as the original single-block directories.
+BUCKET_ENTRIES = 128
+
+# Buckets are serialized as a version byte and an entry count, followed by
+# the binary encodings of each entry's i, the lengths of each entry's name, and
+# finally the names themselves. Keeping the fixed-size parts together lets
+# them be decoded in bulk. Buckets serialized as a pickled list are still
+# understood.
+BUCKET_VERSION = 1
+BUCKET_HEADER = struct.Struct(">BI")
+
+def _pack_bucket(entries):
+    names = [name for name, _ in entries]
+    return b"".join([
+        BUCKET_HEADER.pack(BUCKET_VERSION, len(entries)),
+        I.pack_many([i for _, i in entries]),
+        struct.pack(">{}H".format(len(names)), *map(len, names)),
+    ] + names)
+
+def _unpack_bucket(cnt):
+    if len(cnt) == 0:
+        return []
+    if cnt[0] != BUCKET_VERSION:
+        # buckets used to be pickled lists
+        return pickle.loads(cnt)
+
+    cnt = bytes(cnt)
+    _, count = BUCKET_HEADER.unpack_from(cnt)
+    off = BUCKET_HEADER.size
+    inodes = I.unpack_many(cnt, count, off)
+    off += count * I_STRUCT.size
+    lengths = struct.unpack_from(">{}H".format(count), cnt, off)
+    off += 2 * count
+    names = []
+    for length in lengths:
+        names.append(cnt[off:off+length])
+        off += length
+    return list(zip(names, inodes))
+
+def _bucket_for(name, nbuckets):
+    """
+    Returns the index of the bucket name belongs in when a directory has
+    nbuckets buckets.
+    """
+    h = zlib.crc32(name)
+    level = 1 << (nbuckets.bit_length() - 1)
+    b = h % level
+    if b < nbuckets - level:
+        # this bucket has already been split in the current round
+        b = h % (2 * level)
+    return b
 
 class Directory:
     """
@@ -32,18 +88,85 @@ class Directory:
             raise TypeError("{} is not an I, is a {}".format(i, type(i)))
 
         self.inode = None
-        self.children = []
+        self.buckets = {
+            # bucket index => [(name, i)]
+        }
+        self.dirty = set()
 
         self.inode = secfs.fs.get_inode(i)
         if self.inode.kind != 0:
             raise TypeError("inode with ihash {} is not a directory".format(secfs.tables.resolve(i)))
 
-        cnt = self.inode.read()
-        if len(cnt) != 0:
-            self.children = pickle.loads(cnt)
+        self.nbuckets = max(1, len(self.inode.blocks))
+
+    def _load(self, bs):
+        """
+        Loads the given buckets that have not been loaded already.
+        """
+        missing = [b for b in bs if b not in self.buckets and b < len(self.inode.blocks)]
+        for b, cnt in zip(missing, secfs.store.block.load_many([self.inode.blocks[b] for b in missing])):
+            self.buckets[b] = _unpack_bucket(cnt)
+
+    def _bucket(self, b):
+        self._load([b])
+        return self.buckets.setdefault(b, [])
 
-    def bytes(self):
-        return pickle.dumps(self.children)
+    @property
+    def children(self):
+        """
+        All (name, i) entries in this directory, in bucket order.
+        """
+        self._load(range(self.nbuckets))
+        return [e for b in range(self.nbuckets) for e in self.buckets.get(b, [])]
+
+    def find(self, name):
+        for f in self._bucket(_bucket_for(name, self.nbuckets)):
+            if f[0] == name:
+                return f[1]
+        return None
+
+    def add(self, name, i):
+        b = _bucket_for(name, self.nbuckets)
+        bucket = self._bucket(b)
+        for f in bucket:
+            if f[0] == name:
+                raise KeyError("name {} already exists".format(name))
+
+        bucket.append((name, i))
+        self.dirty.add(b)
+
+        if len(bucket) > BUCKET_ENTRIES:
+            self._split()
+
+    def _split(self):
+        """
+        Splits the next bucket in line, and appends a new bucket to hold the
+        entries that move out of it.
+        """
+        level = 1 << (self.nbuckets.bit_length() - 1)
+        s = self.nbuckets - level
+        entries = self._bucket(s)
+
+        self.nbuckets += 1
+        self.buckets[s] = [e for e in entries if _bucket_for(e[0], self.nbuckets) == s]
+        self.buckets[self.nbuckets - 1] = [e for e in entries if _bucket_for(e[0], self.nbuckets) != s]
+        self.dirty.update([s, self.nbuckets - 1])
+
+    def store(self):
+        """
+        Stores all modified buckets, and then the directory's updated inode.
+        Returns the new inode's hash.
+        """
+        dirty = sorted(self.dirty)
+        chashes = secfs.store.block.store_many([_pack_bucket(self.buckets[b]) for b in dirty])
+
+        blocks = self.inode.blocks + [None] * (self.nbuckets - len(self.inode.blocks))
+        for b, chash in zip(dirty, chashes):
+            blocks[b] = chash
+        self.inode.blocks = blocks
+        self.dirty = set()
+
+        return secfs.store.block.store(self.inode.bytes())
 
 def add(dir_i, name, i):
     """
@@ -56,12 +179,9 @@ def add(dir_i, name, i):
         raise TypeError("{} is not an I, is a {}".format(i, type(i)))
 
     dr = Directory(dir_i)
-    for f in dr.children:
-        if f[0] == name:
-            raise KeyError("asked to add i {} to dir {} under name {}, but name already exists".format(i, dir_i, name))
-
-    dr.children.append((name, i))
-    new_dhash = secfs.store.block.store(dr.bytes())
-    dr.inode.blocks = [new_dhash]
-    new_ihash = secfs.store.block.store(dr.inode.bytes())
-    return new_ihash
+    try:
+        dr.add(name, i)
+    except KeyError:
+        raise KeyError("asked to add i {} to dir {} under name {}, but name already exists".format(i, dir_i, name))
+
+    return dr.store()
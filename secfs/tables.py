@@ -4,37 +4,210 @@
 # NOTE: an ihandle is the hash of a principal's itable, which holds that
 # principal's mapping from inumbers (the second part of an i) to inode hashes.
 
+import types
 import pickle
+import struct
+import logging
 import secfs.store
+import secfs.metrics
 import secfs.fs
-from secfs.types import I, Principal, User, Group
+from secfs.types import I, I_STRUCT, Principal, User, Group
+
+log = logging.getLogger(__name__)
 
 # current_itables represents the current view of the file system's itables
 current_itables = {}
 
+# generations counts how many times each principal's itable in current_itables
+# has been replaced. cached resolutions remember the generations they were
+# resolved under, and are ignored once those change.
+generations = {
+    # principal => int
+}
+
+# resolve_cache memoizes resolve(). for a user i, the target is the ihash; for
+# a group i, it is the user i the group i points to, and ihash is the result of
+# resolving that user i in turn (or _UNRESOLVED if that has not been needed).
+resolve_cache = {
+    # i => (target, ihash, generations)
+}
+# dependents tracks which cached group is resolve through each user i, so that
+# they can be invalidated when the user i is remapped
+dependents = {
+    # user i => set(group i)
+}
+_UNRESOLVED = object()
+
+# principals whose itables have been modified since the last post(), and so
+# have to be published to the server again
+changed = set()
+
+def set_itable(principal, t):
+    """
+    Makes t the current itable for the given principal. Resolutions cached
+    against the principal's previous itable will no longer be used.
+    """
+    global current_itables
+    current_itables[principal] = t
+    generations[principal] = generations.get(principal, 0) + 1
+
+def _generations(i, target):
+    if isinstance(target, I):
+        return (generations.get(i.p, 0), generations.get(target.p, 0))
+    return (generations.get(i.p, 0), None)
+
+def _invalidate(i):
+    """
+    Drops the cached resolutions that depend on the mapping for i.
+    """
+    resolve_cache.pop(i, None)
+    for gi in dependents.pop(i, ()):
+        resolve_cache.pop(gi, None)
+
 # a server connection handle is passed to us at mount time by secfs-fuse
 server = None
+# whether the server collects garbage, and so needs to know every itable
+publishing = False
 def register(_server):
     global server
+    global publishing
     server = _server
+    try:
+        publishing = server.collecting()
+    except AttributeError:
+        # servers that predate the collector
+        publishing = False
 
 def pre(refresh, user):
     """
     Called before all user file system operations, right after we have obtained
     an exclusive server lock.
+
+    Any itable that is refreshed here must be installed using set_itable, so
+    that resolutions cached against the old itable are discarded.
     """
 
     if refresh != None:
         # refresh usermap and groupmap
         refresh()
 
+def publish():
+    """
+    Stores the itables that have changed since they were last published, and
+    tells the server about their new handles, if the server collects garbage:
+    it then needs to know every current itable to tell which blocks are still
+    in use. Returns whether any itable had changed.
+    """
+    global changed
+    if len(changed) == 0:
+        return False
+
+    if publishing:
+        ps = sorted(changed, key=lambda p: (p.is_group(), p.id))
+        ihandles = secfs.store.block.store_many([current_itables[p].bytes() for p in ps])
+        server.set_itables([[p.is_group(), p.id, ihandle] for p, ihandle in zip(ps, ihandles)])
+    changed = set()
+    return True
+
 def post(push_vs):
+    """
+    Called after all user file system operations, right before the server
+    lock is released. Returns whether the operation changed any itable.
+    """
+    modified = publish()
+
     if not push_vs:
         # when creating a root, we should not push a VS (yet)
         # you will probably want to leave this here and
         # put your post() code instead of "pass" below.
-        return
+        return modified
     pass
+    return modified
+
+# itables are split into chunks of ITABLE_CHUNK consecutive inumbers, each
+# stored in its own block, so that changing one mapping only requires storing
+# the chunk that holds it (plus the small top-level block listing the chunks).
+ITABLE_CHUNK = 256
+
+# The top-level itable block is serialized as a version byte, the next
+# inumber, and the number of chunks, followed by each chunk's raw hash
+# (prefixed by a byte saying whether the chunk exists). A chunk is serialized
+# as a version byte and an entry count, followed by the entries' inumbers, a
+# byte per entry saying whether it maps to an inode hash or (for groups) to an
+# i, the raw inode hashes, and finally the binary-encoded is. Pickled itables
+# are still understood. A loaded chunk keeps raw hashes as they are, and only
+# converts the ones that are actually looked up into hex.
+ITABLE_VERSION = 1
+ITABLE_HEADER = struct.Struct(">BQI")
+CHUNK_HEADER = struct.Struct(">BI")
+HASH_SIZE = 28
+
+def _pack_chunk(chunk):
+    ns = sorted(chunk)
+    vs = [chunk[n] for n in ns]
+    header = [
+        CHUNK_HEADER.pack(ITABLE_VERSION, len(ns)),
+        struct.pack(">{}Q".format(len(ns)), *ns),
+    ]
+    try:
+        # user itables never map to is, and their hashes are already raw
+        return b"".join(header + [bytes(len(ns))] + vs)
+    except TypeError:
+        pass
+
+    is_i = bytearray(len(ns))
+    hashes = []
+    inodes = []
+    for k, v in enumerate(vs):
+        if isinstance(v, I):
+            is_i[k] = 1
+            inodes.append(v)
+        else:
+            hashes.append(v)
+    return b"".join(header + [is_i] + hashes + [I.pack_many(inodes)])
+
+def _unpack_chunk(b):
+    if b[0] != ITABLE_VERSION:
+        # pickled chunks hold hex hashes
+        return {n: bytes.fromhex(v) if isinstance(v, str) else v for n, v in pickle.loads(b).items()}
+
+    b = bytes(b)
+    _, count = CHUNK_HEADER.unpack_from(b)
+    off = CHUNK_HEADER.size
+    ns = struct.unpack_from(">{}Q".format(count), b, off)
+    off += 8 * count
+    is_i = b[off:off+count]
+    off += count
+
+    nhashes = count - sum(is_i)
+    # struct splits the hashes apart much faster than slicing each one
+    hashes = struct.unpack_from("{}s".format(HASH_SIZE) * nhashes, b, off)
+    if nhashes == count:
+        # user itables never map to is
+        return dict(zip(ns, hashes))
+
+    hashes = iter(hashes)
+    inodes = iter(I.unpack_many(b, count - nhashes, nhashes*HASH_SIZE + off))
+    return {n: next(inodes) if i else next(hashes) for n, i in zip(ns, is_i)}
+
+def _unpack_itable(b):
+    """
+    Decodes a top-level itable block into the table's next inumber and the
+    hashes of its chunks (None for chunks that have never been stored).
+    """
+    if b[0] != ITABLE_VERSION:
+        return pickle.loads(b)
+
+    _, n, nchunks = ITABLE_HEADER.unpack_from(b)
+    off = ITABLE_HEADER.size
+    chashes = []
+    for _ in range(nchunks):
+        if b[off]:
+            chashes.append(bytes(b[off+1:off+1+HASH_SIZE]).hex())
+        else:
+            chashes.append(None)
+        off += 1 + HASH_SIZE
+    return n, chashes
 
 class Itable:
     """
@@ -43,19 +216,94 @@ class Itable:
     groups.
     """
     def __init__(self):
-        self.mapping = {}
+        self.chunks = {
+            # chunk index => {inumber => raw ihash or i}
+        }
+        # hashes of the stored chunks, loaded lazily into self.chunks
+        self.chashes = []
+        # chunks modified since they were last stored
+        self.dirty = set()
+        # every inumber below next has been allocated
+        self.next = 0
 
+    @staticmethod
     def load(ihandle):
         b = secfs.store.block.load(ihandle)
         if b == None:
             return None
 
         t = Itable()
-        t.mapping = pickle.loads(b)
+        t.next, t.chashes = _unpack_itable(b)
         return t
 
+    def _chunk(self, n):
+        k = n // ITABLE_CHUNK
+        if k not in self.chunks:
+            # operations holding a shared lock may load the same chunk
+            # concurrently; they all end up using the first one loaded
+            if k < len(self.chashes) and self.chashes[k] != None:
+                self.chunks.setdefault(k, _unpack_chunk(secfs.store.block.load(self.chashes[k])))
+            else:
+                self.chunks.setdefault(k, {})
+        return self.chunks[k]
+
+    def __contains__(self, n):
+        return n >= 0 and n < self.next and n in self._chunk(n)
+
+    def __getitem__(self, n):
+        v = self._chunk(n)[n]
+        if isinstance(v, bytes):
+            return v.hex()
+        return v
+
+    def __setitem__(self, n, ihash):
+        # hashes are kept raw, so that chunks can be stored without
+        # converting each of them again
+        self._chunk(n)[n] = bytes.fromhex(ihash) if isinstance(ihash, str) else ihash
+        self.dirty.add(n // ITABLE_CHUNK)
+        self.next = max(self.next, n + 1)
+
+    def alloc(self):
+        """
+        Returns a fresh inumber. Inumbers are never freed, so this is simply
+        the next one after the highest allocated so far.
+        """
+        return self.next
+
+    @property
+    def mapping(self):
+        """
+        The entire inumber mapping, as a read-only snapshot. This loads every
+        chunk of the table. Writes to the snapshot fail; change the table
+        itself instead, with itable[n] = ihash, and get fresh inumbers from
+        alloc().
+        """
+        m = {}
+        for k in range((self.next + ITABLE_CHUNK - 1) // ITABLE_CHUNK):
+            m.update(self._chunk(k * ITABLE_CHUNK))
+        return types.MappingProxyType({n: v.hex() if isinstance(v, bytes) else v for n, v in m.items()})
+
     def bytes(self):
-        return pickle.dumps(self.mapping)
+        """
+        Stores any chunks that have changed since they were last stored, and
+        returns the serialized top-level table referring to all chunks.
+        """
+        dirty = sorted(self.dirty)
+        chashes = secfs.store.block.store_many([_pack_chunk(self.chunks[k]) for k in dirty])
+
+        nchunks = max([len(self.chashes)] + [k + 1 for k in dirty])
+        self.chashes += [None] * (nchunks - len(self.chashes))
+        for k, chash in zip(dirty, chashes):
+            self.chashes[k] = chash
+        self.dirty = set()
+
+        out = [ITABLE_HEADER.pack(ITABLE_VERSION, self.next, len(self.chashes))]
+        for chash in self.chashes:
+            if chash == None:
+                out.append(bytes(1 + HASH_SIZE))
+            else:
+                out.append(b"\x01" + bytes.fromhex(chash))
+        return b"".join(out)
 
 def resolve(i, resolve_groups = True):
     """
@@ -85,23 +333,44 @@ def resolve(i, resolve_groups = True):
         # User does not yet have an itable
         return None 
 
+    if i in resolve_cache:
+        target, ihash, gens = resolve_cache[i]
+        if gens == _generations(i, target):
+            if not isinstance(target, I) or not resolve_groups:
+                secfs.metrics.count("tables.resolve.hits")
+                return target
+            if ihash is not _UNRESOLVED:
+                secfs.metrics.count("tables.resolve.hits")
+                return ihash
+
+    secfs.metrics.count("tables.resolve.misses")
     t = current_itables[principal]
 
-    if i.n not in t.mapping:
+    if i.n not in t:
         raise LookupError("principal {} does not have i {}".format(principal, i))
 
+    target = t[i.n]
+
     # santity checks
-    if principal.is_group() and not isinstance(t.mapping[i.n], I):
+    if principal.is_group() and not isinstance(target, I):
         raise TypeError("looking up group i, but did not get indirection ihash")
-    if principal.is_user() and isinstance(t.mapping[i.n], I):
+    if principal.is_user() and isinstance(target, I):
         raise TypeError("looking up user i, but got indirection ihash")
 
-    if isinstance(t.mapping[i.n], I) and resolve_groups:
-        # we're looking up a group i
-        # follow the indirection
-        return resolve(t.mapping[i.n])
+    ihash = target
+    if isinstance(target, I):
+        ihash = _UNRESOLVED
+        if resolve_groups:
+            # we're looking up a group i
+            # follow the indirection
+            ihash = resolve(target)
+        dependents.setdefault(target, set()).add(i)
+
+    resolve_cache[i] = (target, ihash, _generations(i, target))
 
-    return t.mapping[i.n]
+    if isinstance(target, I) and not resolve_groups:
+        return target
+    return ihash
 
 def modmap(mod_as, i, ihash):
     """
@@ -126,7 +395,7 @@ def modmap(mod_as, i, ihash):
     assert mod_as.is_user() # only real users can mod
 
     if mod_as != i.p:
-        print("trying to mod object for {} through {}".format(i.p, mod_as))
+        log.debug("trying to mod object for %s through %s", i.p, mod_as)
         assert i.p.is_group() # if not for self, then must be for group
 
         real_i = resolve(i, False)
@@ -139,14 +408,14 @@ def modmap(mod_as, i, ihash):
             if isinstance(ihash, I):
                 # Caller has done the work for us, so we just need to link up
                 # the group entry.
-                print("mapping", i, "to", ihash, "which again points to", resolve(ihash))
+                log.debug("mapping %s to %s", i, ihash)
             else:
                 # Allocate a new entry for mod_as, and continue as though ihash
                 # was that new i.
                 # XXX: kind of unnecessary to send two VS for this
                 _ihash = ihash
                 ihash = modmap(mod_as, I(mod_as), ihash)
-                print("mapping", i, "to", ihash, "which again points to", _ihash)
+                log.debug("mapping %s to %s which again points to %s", i, ihash, _ihash)
         else:
             # This is not a group i!
             # User is trying to overwrite something they don't own!
@@ -161,23 +430,22 @@ def modmap(mod_as, i, ihash):
             # user did not have an itable, but an inumber was given
             raise ReferenceError("itable not available")
         t = Itable()
-        print("no current list for principal", i.p, "; creating empty table", t.mapping)
+        set_itable(i.p, t)
+        log.info("no current list for principal %s; creating empty table", i.p)
     else:
         t = current_itables[i.p]
 
     # look up (or allocate) the inumber for the i we want to modify
     if not i.allocated():
-        inumber = 0
-        while inumber in t.mapping:
-            inumber += 1
-        i.allocate(inumber)
+        i.allocate(t.alloc())
     else:
-        if i.n not in t.mapping:
+        if i.n not in t:
             raise IndexError("invalid inumber")
 
     # modify the entry, and store back the updated itable
     if i.p.is_group():
-        print("mapping", i.n, "for group", i.p, "into", t.mapping)
-    t.mapping[i.n] = ihash # for groups, ihash is an i
-    current_itables[i.p] = t
+        log.debug("mapping %s for group %s to %s", i.n, i.p, ihash)
+    t[i.n] = ihash # for groups, ihash is an i
+    changed.add(i.p)
+    _invalidate(i)
     return i
@@ -1,4 +1,7 @@
+import struct
+
 class Principal:
+    __slots__ = ()
     @property
     def id(self):
         return -1
@@ -8,15 +11,18 @@ class Principal:
         return False
 
 class User(Principal):
+    __slots__ = ("_uid", "_hash")
     def __init__(self, uid):
         if not isinstance(uid, int):
             raise TypeError("id {} is not an int, is a {}".format(uid, type(uid)))
 
         self._uid = uid
+        self._hash = hash(uid)
     def __getstate__(self):
         return (self._uid, False)
     def __setstate__(self, state):
         self._uid = state[0]
+        self._hash = hash(self._uid)
     @property
     def id(self):
         return self._uid
@@ -27,18 +33,21 @@ class User(Principal):
     def __str__(self):
         return "<uid={}>".format(self._uid)
     def __hash__(self):
-        return hash(self._uid)
+        return self._hash
 
 class Group(Principal):
+    __slots__ = ("_gid", "_hash")
     def __init__(self, gid):
         if not isinstance(gid, int):
             raise TypeError("id {} is not an int, is a {}".format(gid, type(gid)))
 
         self._gid = gid
+        self._hash = hash(gid)
     def __getstate__(self):
         return (self._gid, True)
     def __setstate__(self, state):
         self._gid = state[0]
+        self._hash = hash(self._gid)
     @property
     def id(self):
         return self._gid
@@ -49,9 +58,14 @@ class Group(Principal):
     def __str__(self):
         return "<gid={}>".format(self._gid)
     def __hash__(self):
-        return hash(self._gid)
+        return self._hash
+
+# the binary encoding of an allocated i: whether the principal is a group, the
+# principal's (32-bit) id, and the inumber
+I_STRUCT = struct.Struct(">?IQ")
 
 class I:
+    __slots__ = ("_p", "_n", "_hash")
     def __init__(self, principal, inumber=None):
         if not isinstance(principal, Principal):
             raise TypeError("{} is not a Principal, is a {}".format(principal, type(principal)))
@@ -60,11 +74,13 @@ class I:
 
         self._p = principal
         self._n = inumber
+        self._hash = None
     def __getstate__(self):
         return (self._p, self._n)
     def __setstate__(self, state):
         self._p = state[0]
         self._n = state[1]
+        self._hash = None
     @property
     def p(self):
         return self._p
@@ -77,6 +93,59 @@ class I:
         self._n = inumber
     def allocated(self):
         return self._n is not None
+    def pack(self):
+        """
+        Returns the binary encoding of this (allocated) i.
+        """
+        if not self.allocated():
+            raise TypeError("cannot encode unallocated i {}".format(self))
+        return I_STRUCT.pack(self._p.is_group(), self._p.id, self._n)
+    @staticmethod
+    def unpack_from(buf, offset=0):
+        """
+        Decodes the i encoded at the given offset in buf.
+        """
+        is_group, pid, n = I_STRUCT.unpack_from(buf, offset)
+        return I(Group(pid) if is_group else User(pid), n)
+    @staticmethod
+    def pack_many(is_):
+        """
+        Returns the binary encoding of the given (allocated) is, one after
+        the other.
+        """
+        flat = []
+        for i in is_:
+            if i._n is None:
+                raise TypeError("cannot encode unallocated i {}".format(i))
+            flat += (i._p.is_group(), i._p.id, i._n)
+        # a single call for the whole array, rather than one per i
+        return struct.pack(">" + "?IQ" * len(is_), *flat)
+    @staticmethod
+    def unpack_many(buf, count, offset=0):
+        """
+        Decodes count consecutive is encoded at the given offset in buf. Is
+        with the same principal share a single Principal object.
+        """
+        flat = struct.unpack_from(">" + "?IQ" * count, buf, offset)
+        principals = {
+            # uid, or ~gid for groups => Principal
+        }
+        out = []
+        new = I.__new__
+        fields = iter(flat)
+        for is_group, pid, n in zip(fields, fields, fields):
+            key = ~pid if is_group else pid
+            p = principals.get(key)
+            if p is None:
+                p = Group(pid) if is_group else User(pid)
+                principals[key] = p
+            # skip __init__'s type checks; the fields are known to be valid
+            i = new(I)
+            i._p = p
+            i._n = n
+            i._hash = None
+            out.append(i)
+        return out
     def __eq__(self, other):
         return isinstance(other, I) and self._p == other._p and self._n == other._n
     def __str__(self):
@@ -84,6 +153,8 @@ class I:
             return "({}, {})".format(self._p, self._n)
         return "({}, <unallocated>)".format(self._p)
     def __hash__(self):
-        if not self.allocated():
-            raise TypeError("cannot hash unallocated i {}".format(self))
-        return hash((self._p, self._n))
+        if self._hash is None:
+            if not self.allocated():
+                raise TypeError("cannot hash unallocated i {}".format(self))
+            self._hash = hash((self._p, self._n))
+        return self._hash
@@ -0,0 +1,93 @@
+import os
+import unittest
+
+import secfs.local
+import secfs.store.block
+
+class FailingServer(secfs.local.LocalServer):
+    """
+    A LocalServer whose stores fail while fail is set.
+    """
+    fail = False
+
+    def store(self, blob):
+        if self.fail:
+            raise IOError("disk full")
+        return super().store(blob)
+
+class BlockTest(unittest.TestCase):
+    def setUp(self):
+        self.server = FailingServer()
+        secfs.local.mount(self.server)
+
+    def test_round_trip(self):
+        blob = os.urandom(1000)
+        chash = secfs.store.block.store_async(blob).result()
+        self.assertEqual(secfs.store.block.load(chash), blob)
+        self.assertEqual(secfs.store.block.load_async(chash).result(), blob)
+
+        blobs = [os.urandom(100) for _ in range(10)]
+        chashes = secfs.store.block.store_many(blobs)
+        self.assertEqual(secfs.store.block.load_many(chashes), blobs)
+
+    def test_failed_store(self):
+        self.server.fail = True
+        blob = os.urandom(1000)
+        future = secfs.store.block.store_async(blob)
+        with self.assertRaises(IOError):
+            future.result()
+        with self.assertRaises(IOError):
+            secfs.store.block.store(os.urandom(1000))
+
+        # the block must not be served from the cache, as the server never
+        # got it
+        self.assertIsNone(secfs.store.block.load(future.chash))
+        self.assertIsNone(secfs.store.block.load_async(future.chash).result())
+
+        self.server.fail = False
+        secfs.store.block.store(blob)
+        self.assertEqual(secfs.store.block.load(future.chash), blob)
+
+    def test_failed_store_many(self):
+        self.server.fail = True
+        blobs = [os.urandom(100) for _ in range(10)]
+        future = secfs.store.block.store_many_async(blobs)
+        with self.assertRaises(IOError):
+            future.result()
+        self.assertEqual(secfs.store.block.load_many(future.chashes), [None] * len(blobs))
+
+class ShardTest(unittest.TestCase):
+    def setUp(self):
+        secfs.local.mount(secfs.local.LocalServer())
+        self.shards = [secfs.local.LocalServer(), secfs.local.LocalServer()]
+        secfs.store.block.shards = self.shards
+
+    def tearDown(self):
+        secfs.store.block.shards = []
+
+    def _uncached(self):
+        capacity = secfs.store.block.cache_capacity
+        secfs.store.block.set_cache_capacity(0)
+        secfs.store.block.set_cache_capacity(capacity)
+
+    def test_round_trip(self):
+        blobs = [os.urandom(100) for _ in range(20)]
+        chashes = secfs.store.block.store_many(blobs)
+        chashes.append(secfs.store.block.store(b"one more"))
+        blobs.append(b"one more")
+        for chash in chashes:
+            shard = self.shards[secfs.store.block.shard_for(chash)]
+            self.assertIn(chash, shard.blocks)
+        self.assertTrue(all(len(shard.blocks) > 0 for shard in self.shards))
+
+        self._uncached()
+        self.assertEqual(secfs.store.block.load_many(chashes), blobs)
+        self._uncached()
+        for chash, blob in zip(chashes, blobs):
+            self.assertEqual(secfs.store.block.load(chash), blob)
+        self._uncached()
+        futures = [secfs.store.block.load_async(chash) for chash in chashes]
+        self.assertEqual([f.result() for f in futures], blobs)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import os
+import unittest
+
+import secfs.local
+import secfs.store.block
+import secfs.store.inode
+import secfs.store.compress
+from secfs.store.compress import compress, decompress, STORED, SAMPLE_SIZE
+from secfs.store.inode import Inode, BLOCK_SIZE
+
+TEXT = b"".join("line {} of some log file\n".format(n).encode() for n in range(5000))
+
+class CompressTest(unittest.TestCase):
+    def test_round_trip(self):
+        for name in [None] + sorted(secfs.store.compress.codecs):
+            blob = compress(TEXT, name)
+            if name != None:
+                self.assertNotEqual(blob[0], STORED, name)
+                self.assertLess(len(blob), len(TEXT), name)
+            self.assertEqual(bytes(decompress(blob)), TEXT, name)
+
+    def test_memoryview(self):
+        view = memoryview(TEXT)[100:100+SAMPLE_SIZE]
+        for name in (None, "zlib"):
+            self.assertEqual(bytes(decompress(compress(view, name))), bytes(view), name)
+
+    def test_incompressible_sample(self):
+        data = os.urandom(4 * SAMPLE_SIZE)
+        self.assertFalse(secfs.store.compress.compressible(data))
+        self.assertTrue(secfs.store.compress.compressible(TEXT))
+        blob = compress(data, "zlib")
+        self.assertEqual(blob[0], STORED)
+        self.assertEqual(bytes(decompress(blob)), data)
+
+    def test_unknown_codec(self):
+        with self.assertRaises(ValueError):
+            decompress(bytes([200]) + TEXT)
+        with self.assertRaises(ValueError):
+            secfs.store.compress.set_codec("nonexistent")
+
+class FramedInodeTest(unittest.TestCase):
+    def setUp(self):
+        secfs.local.mount(secfs.local.LocalServer())
+        self.codec = secfs.store.compress.codec
+        secfs.store.compress.set_codec("zlib")
+
+    def tearDown(self):
+        secfs.store.compress.codec = self.codec
+
+    def test_framed(self):
+        data = TEXT[:BLOCK_SIZE] + os.urandom(BLOCK_SIZE)
+        node = Inode()
+        node.kind = 1
+        node.write(0, data)
+        b = node.bytes()
+        self.assertTrue(Inode.from_bytes(b).framed)
+        # the text compresses, the random data does not
+        headers = [secfs.store.block.load(chash)[0] for chash in node.blocks]
+        self.assertNotEqual(headers[0], STORED)
+        self.assertEqual(headers[-1], STORED)
+
+        node = Inode.from_bytes(b)
+        self.assertEqual(node.read(), data)
+        self.assertEqual(node.read_range(BLOCK_SIZE - 5, 10), data[BLOCK_SIZE-5:BLOCK_SIZE+5])
+
+    def test_unframed(self):
+        # inodes from before framing have chunks without a header byte, which
+        # are never compressed, even when written to
+        node = Inode()
+        node.kind = 1
+        node.framed = False
+        node.write(0, TEXT)
+        node = Inode.from_bytes(node.bytes())
+        self.assertFalse(node.framed)
+        self.assertEqual(secfs.store.block.load(node.blocks[0]), TEXT[:BLOCK_SIZE])
+        self.assertEqual(node.read(), TEXT)
+
+    def test_directories_are_not_framed(self):
+        node = Inode()
+        node.kind = 0
+        b = node.bytes()
+        self.assertEqual(b[2] & secfs.store.inode.FLAG_FRAMED, 0)
+        self.assertFalse(Inode.from_bytes(b).framed)
+
+if __name__ == '__main__':
+    unittest.main()
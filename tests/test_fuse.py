@@ -0,0 +1,88 @@
+import os
+import unittest
+import importlib.util
+import importlib.machinery
+
+import secfs.local
+from secfs.local import owner
+
+try:
+    import llfuse
+except ImportError:
+    llfuse = None
+
+# bin/secfs-fuse is a script rather than a module, so it is loaded by path
+fuse = None
+if llfuse is not None:
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bin", "secfs-fuse")
+    loader = importlib.machinery.SourceFileLoader("secfs_fuse", path)
+    fuse = importlib.util.module_from_spec(importlib.util.spec_from_loader(loader.name, loader))
+    loader.exec_module(fuse)
+
+@unittest.skipIf(llfuse is None, "llfuse is not installed")
+class CacheTest(unittest.TestCase):
+    def setUp(self):
+        self.server = secfs.local.LocalServer()
+        self.root = secfs.local.mount(self.server)
+        self.f = secfs.local.create(self.root, b"f")
+        self.fs = fuse.SecFS(None, "/", None, [])
+        self.fs.local.server = self.server
+        fuse._validate_caches(None)
+
+    def _shared(self):
+        # the start of a read-only operation, which may use the caches
+        self.fs._pre(owner, do_refresh=False, shared=True)
+        attr = fuse._getattr(self.f)
+        self.fs._post()
+        return attr
+
+    def _other_client(self, changed):
+        self.server.lock()
+        self.server.unlock(changed)
+
+    def test_unchanged_version_keeps_caches(self):
+        attr = self._shared()
+        self.assertEqual(fuse.cache_version, self.server.version)
+        self.assertIs(fuse.attrs[self.f], attr)
+        self.assertIs(self._shared(), attr)
+
+        self._other_client(False)
+        self.assertIs(self._shared(), attr)
+
+    def test_version_change_drops_caches(self):
+        attr = self._shared()
+        fuse.dentries[(self.root, b"f")] = self.f
+        self._other_client(True)
+
+        self.assertIsNot(self._shared(), attr)
+        self.assertEqual(fuse.cache_version, self.server.version)
+        self.assertNotIn((self.root, b"f"), fuse.dentries)
+
+    def test_exclusive_ops(self):
+        attr = self._shared()
+        fuse.dentries[(self.root, b"f")] = self.f
+
+        # caches are dropped, and not filled, until an exclusive operation is
+        # done, as its own changes do not move the version until then
+        self.fs._pre(owner, do_refresh=False)
+        self.assertIsNone(fuse.cache_version)
+        self.assertEqual(len(fuse.dentries), 0)
+        self.assertEqual(len(fuse.attrs), 0)
+        secfs.local.create(self.root, b"g")
+        fuse._getattr(self.f)
+        self.assertEqual(len(fuse.attrs), 0)
+        version = self.server.version
+        self.fs._post()
+        self.assertGreater(self.server.version, version)
+
+        self.assertIsNot(self._shared(), attr)
+        self.assertEqual(fuse.cache_version, self.server.version)
+
+        # an exclusive operation that changes nothing leaves the version be
+        version = self.server.version
+        self.fs._pre(owner, do_refresh=False)
+        self.fs._post()
+        self.assertEqual(self.server.version, version)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import os
+import unittest
+
+import secfs.fs
+import secfs.local
+import secfs.tables
+import secfs.store.gc
+import secfs.store.tree
+import secfs.store.block
+from secfs.local import owner
+from secfs.store.inode import BLOCK_SIZE
+
+def nothing():
+    pass
+
+class CollectorTest(unittest.TestCase):
+    def setUp(self):
+        self.server = secfs.local.LocalServer(collecting=True)
+        self.root = secfs.local.mount(self.server)
+        self.collector = secfs.store.gc.Collector(self.server, nothing, nothing, nothing, nothing, grace=0)
+
+    def test_nothing_published(self):
+        self.server.itables.clear()
+        self.assertIsNone(self.collector.collect())
+        self.assertNotEqual(len(self.server.blocks), 0)
+
+    def test_sweep(self):
+        f = secfs.local.create(self.root, b"f")
+        secfs.fs.write(owner, f, 0, os.urandom(2 * BLOCK_SIZE))
+        secfs.tables.post(True)
+        old = set(self.server.blocks)
+
+        data = os.urandom(2 * BLOCK_SIZE)
+        secfs.fs.write(owner, f, 0, data)
+        secfs.tables.post(True)
+
+        stats = self.collector.collect()
+        self.assertGreater(stats["reclaimed_blocks"], 0)
+        self.assertEqual(stats["live_blocks"], len(self.server.blocks))
+        # the old contents are gone, while the file and its directory remain
+        self.assertTrue(old - set(self.server.blocks))
+        self.assertEqual(secfs.fs.read(owner, f, 0, len(data)), data)
+        self.assertEqual(secfs.store.tree.find_under(self.root, b"f"), f)
+
+        stats = self.collector.collect()
+        self.assertEqual(stats["reclaimed_blocks"], 0)
+
+    def test_touched_blocks_are_kept(self):
+        self.collector.grace = 60
+        chash = secfs.store.block.store(b"not referred to by anything")
+        self.collector.touch(chash)
+        self.collector.collect()
+        self.assertIn(chash, self.server.blocks)
+
+        self.collector.grace = 0
+        self.collector.collect()
+        self.assertNotIn(chash, self.server.blocks)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+import os
+import pickle
+import unittest
+
+import secfs.local
+import secfs.store.block
+from secfs.store.inode import Inode, BLOCK_SIZE
+
+class ChunkedInodeTest(unittest.TestCase):
+    def setUp(self):
+        secfs.local.mount(secfs.local.LocalServer())
+
+    def _file(self, data):
+        node = Inode()
+        node.kind = 1
+        node.write(0, data)
+        node.bytes()
+        return node
+
+    def test_write_only_restores_touched_chunks(self):
+        data = os.urandom(3 * BLOCK_SIZE)
+        node = self._file(data)
+        before = list(node.blocks)
+        self.assertEqual(len(before), 3)
+
+        node.write(BLOCK_SIZE + 10, b"hello")
+        node.bytes()
+        self.assertEqual(node.blocks[0], before[0])
+        self.assertNotEqual(node.blocks[1], before[1])
+        self.assertEqual(node.blocks[2], before[2])
+
+        data = data[:BLOCK_SIZE + 10] + b"hello" + data[BLOCK_SIZE + 15:]
+        self.assertEqual(node.read(), data)
+
+    def test_read_range(self):
+        data = os.urandom(2 * BLOCK_SIZE + 100)
+        node = self._file(data)
+        self.assertEqual(node.read_range(BLOCK_SIZE - 5, 10), data[BLOCK_SIZE-5:BLOCK_SIZE+5])
+        self.assertEqual(node.read_range(2 * BLOCK_SIZE, 1000), data[2*BLOCK_SIZE:])
+        self.assertEqual(node.read_range(len(data), 10), b"")
+
+    def test_write_past_end_zero_fills(self):
+        node = self._file(b"abc")
+        node.write(BLOCK_SIZE + 1, b"xyz")
+        node.bytes()
+        self.assertEqual(node.size, BLOCK_SIZE + 4)
+        self.assertEqual(node.read(), b"abc" + bytes(BLOCK_SIZE - 2) + b"xyz")
+
+    def test_pickled_inode(self):
+        # inodes from before chunking kept the whole file in one block
+        data = os.urandom(200 * 1024)
+        state = {"size": len(data), "kind": 1, "ex": False, "ctime": 0, "mtime": 0,
+                 "blocks": [secfs.store.block.store(data)]}
+        node = Inode.from_bytes(pickle.dumps(state))
+        self.assertFalse(node.framed)
+        self.assertEqual(node.read(), data)
+        self.assertEqual(node.read_range(100 * 1024, 10), data[100*1024:100*1024+10])
+
+        node.write(150 * 1024, b"xyz")
+        node.bytes()
+        data = data[:150*1024] + b"xyz" + data[150*1024+3:]
+        self.assertEqual(node.size, len(data))
+        self.assertEqual(node.read(), data)
+
+        node.write(len(data), b"more")
+        node.bytes()
+        self.assertEqual(node.read(), data + b"more")
+
+class EncodingTest(unittest.TestCase):
+    def setUp(self):
+        secfs.local.mount(secfs.local.LocalServer())
+
+    def test_round_trip(self):
+        node = Inode()
+        node.kind = 1
+        node.ex = True
+        node.ctime = 1.5
+        node.mtime = 1234567890123456789
+        node.write(0, os.urandom(BLOCK_SIZE + 1))
+        d = Inode.from_bytes(node.bytes())
+        for field in ("kind", "ex", "size", "bsize", "ctime", "mtime", "blocks", "framed"):
+            self.assertEqual(getattr(d, field), getattr(node, field), field)
+
+    def test_extra_attributes_are_kept(self):
+        node = Inode()
+        node.kind = 1
+        node.owner_note = "kept"
+        self.assertEqual(Inode.from_bytes(node.bytes()).owner_note, "kept")
+
+if __name__ == '__main__':
+    unittest.main()
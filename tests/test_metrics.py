@@ -0,0 +1,68 @@
+import os
+import unittest
+
+import secfs.fs
+import secfs.local
+import secfs.metrics
+from secfs.metrics import Histogram
+
+class HistogramTest(unittest.TestCase):
+    def test_buckets(self):
+        h = Histogram()
+        for us in (0, 1, 3, 1000):
+            h.observe(us / 1000000)
+        self.assertEqual(h.count, 4)
+        self.assertEqual(h.buckets[0], 1)
+        self.assertEqual(h.buckets[1], 1)
+        self.assertEqual(h.buckets[2], 1)
+        self.assertEqual(h.buckets[10], 1)
+        self.assertAlmostEqual(h.max, 0.001)
+
+    def test_quantile(self):
+        h = Histogram()
+        self.assertEqual(h.quantile(0.5), 0.0)
+        for _ in range(99):
+            h.observe(0.000010)
+        h.observe(0.5)
+        # upper bounds of the buckets, never beyond the largest observation
+        self.assertEqual(h.quantile(0.5), 16 / 1000000)
+        self.assertEqual(h.quantile(1.0), 0.5)
+
+class MetricsTest(unittest.TestCase):
+    def setUp(self):
+        secfs.metrics.reset()
+
+    def test_timed(self):
+        @secfs.metrics.timed("test.op")
+        def op(fail):
+            if fail:
+                raise ValueError()
+        op(False)
+        with self.assertRaises(ValueError):
+            op(True)
+        self.assertEqual(secfs.metrics.histograms["test.op"].count, 2)
+
+    def test_report(self):
+        secfs.metrics.count("test.counter", 3)
+        secfs.metrics.count("test.counter")
+        secfs.metrics.observe("test.hist", 0.002)
+        secfs.metrics.gauge("test.gauge", lambda: 42)
+        lines = secfs.metrics.report().splitlines()
+        self.assertIn("test.counter 4", lines)
+        self.assertIn("test.gauge 42", lines)
+        self.assertIn("test.hist count=1 total=2.000 p50=2.000 p99=2.000 max=2.000", lines)
+
+        secfs.metrics.reset()
+        self.assertNotIn("test.counter 4", secfs.metrics.report().splitlines())
+        del secfs.metrics.gauges["test.gauge"]
+
+    def test_block_rpcs(self):
+        root = secfs.local.mount(secfs.local.LocalServer())
+        secfs.metrics.reset()
+        f = secfs.local.create(root, b"f")
+        secfs.fs.write(secfs.local.owner, f, 0, os.urandom(1000))
+        self.assertGreater(secfs.metrics.histograms["rpc.store_many"].count, 0)
+        self.assertGreaterEqual(secfs.metrics.counters["rpc.bytes_sent"], 1000)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import os
+import pickle
+import hashlib
+import tempfile
+import unittest
+
+import secfs.store.pack
+from secfs.store.pack import PackStore, RECORD
+
+def block(n):
+    blob = "block {}".format(n).encode() * (n + 1)
+    return hashlib.sha224(blob).hexdigest(), blob
+
+class PackStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = self.dir.name
+        self.threshold = secfs.store.pack.MERGE_THRESHOLD
+        # merge into the on-disk index every few blocks
+        secfs.store.pack.MERGE_THRESHOLD = 4
+
+    def tearDown(self):
+        secfs.store.pack.MERGE_THRESHOLD = self.threshold
+        self.dir.cleanup()
+
+    def _fill(self, store, ns):
+        for n in ns:
+            chash, blob = block(n)
+            store[chash] = blob
+
+    def _check(self, store, present, absent=()):
+        for n in present:
+            chash, blob = block(n)
+            self.assertIn(chash, store)
+            self.assertEqual(bytes(store[chash]), blob)
+        for n in absent:
+            chash, _ = block(n)
+            self.assertNotIn(chash, store)
+            with self.assertRaises(KeyError):
+                store[chash]
+
+    def test_lookups_across_index_and_recent(self):
+        store = PackStore(self.path)
+        self._fill(store, range(10))
+        # two merges have happened, and the last blocks are only in memory
+        self.assertEqual(store.index_count, 8)
+        self.assertEqual(len(store.recent), 2)
+        self.assertEqual(len(store), 10)
+        self._check(store, range(10), [10])
+        self.assertNotIn("not a hash", store)
+
+        # storing a block again does not append it again
+        end = store._end()
+        self._fill(store, [3, 9])
+        self.assertEqual(store._end(), end)
+
+    def test_reopen(self):
+        store = PackStore(self.path)
+        self._fill(store, range(10))
+        store.sync()
+
+        store = PackStore(self.path)
+        self.assertEqual(store.index_count, 8)
+        self.assertEqual(len(store.recent), 2)
+        self._check(store, range(10))
+
+    def test_torn_append(self):
+        store = PackStore(self.path)
+        self._fill(store, range(6))
+        end = store._end()
+        chash, blob = block(6)
+        with open(os.path.join(self.path, "blocks.pack"), "ab") as f:
+            f.write(RECORD.pack(bytes.fromhex(chash), len(blob)) + blob[:len(blob) // 2])
+
+        store = PackStore(self.path)
+        self.assertEqual(store._end(), end)
+        self._check(store, range(6), [6])
+        self._fill(store, [6, 7])
+        self._check(PackStore(self.path), range(8))
+
+    def test_snapshot(self):
+        store = PackStore(self.path)
+        self._fill(store, range(3))
+        snapshot = pickle.dumps(store)
+
+        # later blocks are merged into the index, which then covers blocks
+        # the snapshot does not have
+        self._fill(store, range(3, 10))
+        self.assertGreater(store.index_count, 3)
+
+        store = pickle.loads(snapshot)
+        self._check(store, range(3), range(3, 10))
+        self._fill(store, [5])
+        self._check(PackStore(self.path), [0, 1, 2, 5], [3, 4])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import os
+import unittest
+
+import secfs.fs
+import secfs.local
+import secfs.store.block
+from secfs.local import owner
+from secfs.fs import Readahead
+from secfs.store.inode import BLOCK_SIZE
+
+class ReadaheadTest(unittest.TestCase):
+    def setUp(self):
+        root = secfs.local.mount(secfs.local.LocalServer())
+        self.data = os.urandom(20 * BLOCK_SIZE)
+        self.f = secfs.local.create(root, b"f")
+        secfs.fs.write(owner, self.f, 0, self.data)
+        self.chunks = secfs.fs.get_inode(self.f).blocks
+
+        self.prefetched = []
+        self.prefetch = secfs.store.block.prefetch
+        def prefetch(chashes):
+            self.prefetched.extend(chashes)
+            return self.prefetch(chashes)
+        secfs.store.block.prefetch = prefetch
+
+    def tearDown(self):
+        secfs.store.block.prefetch = self.prefetch
+
+    def _read(self, ra, off, size):
+        self.assertEqual(secfs.fs.read(owner, self.f, off, size, ra), self.data[off:off+size])
+
+    def test_sequential(self):
+        ra = Readahead(window=8)
+        self._read(ra, 0, BLOCK_SIZE)
+        self.assertEqual(self.prefetched, self.chunks[1:1+Readahead.initial])
+
+        for n in range(1, 20):
+            self._read(ra, n * BLOCK_SIZE, BLOCK_SIZE)
+        # every chunk after the first was read ahead, and only once
+        self.assertEqual(self.prefetched, self.chunks[1:])
+
+    def test_random(self):
+        ra = Readahead(window=8)
+        for n in (5, 12, 3, 17, 9):
+            self._read(ra, n * BLOCK_SIZE + 7, 100)
+        self.assertEqual(self.prefetched, [])
+
+        # a random read ends a sequential stream
+        self._read(ra, 9 * BLOCK_SIZE + 107, BLOCK_SIZE)
+        self.assertEqual(len(self.prefetched), Readahead.initial)
+        self._read(ra, 2 * BLOCK_SIZE, 10)
+        self.assertEqual(ra.window, 0)
+        self.assertEqual(ra.futures, [])
+
+if __name__ == '__main__':
+    unittest.main()
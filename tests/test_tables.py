@@ -0,0 +1,147 @@
+import os
+import pickle
+import unittest
+
+import secfs.local
+import secfs.tables
+import secfs.store.block
+from secfs.local import owner, group
+from secfs.tables import Itable, ITABLE_CHUNK, resolve, _pack_chunk, _unpack_chunk
+from secfs.types import I, User, Group
+
+def ihash():
+    return os.urandom(28).hex()
+
+class ChunkEncodingTest(unittest.TestCase):
+    def test_user_chunk(self):
+        chunk = {n: os.urandom(28) for n in range(ITABLE_CHUNK, 2 * ITABLE_CHUNK, 3)}
+        self.assertEqual(_unpack_chunk(_pack_chunk(chunk)), chunk)
+
+    def test_group_chunk(self):
+        chunk = {n: I(User(1000 + n % 3), n) for n in range(10)}
+        chunk[11] = os.urandom(28)
+        chunk[12] = I(Group(5), 7)
+        self.assertEqual(_unpack_chunk(_pack_chunk(chunk)), chunk)
+
+    def test_pickled_chunk(self):
+        h = ihash()
+        chunk = _unpack_chunk(pickle.dumps({0: h, 1: I(User(1), 2)}))
+        self.assertEqual(chunk, {0: bytes.fromhex(h), 1: I(User(1), 2)})
+
+class ItableTest(unittest.TestCase):
+    def setUp(self):
+        self.server = secfs.local.LocalServer()
+        secfs.local.mount(self.server)
+
+    def test_alloc(self):
+        t = Itable()
+        self.assertEqual(t.alloc(), 0)
+        t[0] = ihash()
+        t[1] = ihash()
+        self.assertEqual(t.alloc(), 2)
+        t[ITABLE_CHUNK + 5] = ihash()
+        self.assertEqual(t.alloc(), ITABLE_CHUNK + 6)
+
+    def test_lookup(self):
+        t = Itable()
+        h = ihash()
+        t[3] = h
+        self.assertIn(3, t)
+        self.assertNotIn(4, t)
+        self.assertNotIn(-1, t)
+        self.assertEqual(t[3], h)
+
+    def test_mapping_is_read_only(self):
+        t = Itable()
+        h = ihash()
+        t[3] = h
+        self.assertEqual(dict(t.mapping), {3: h})
+        with self.assertRaises(TypeError):
+            t.mapping[4] = ihash()
+        self.assertNotIn(4, t)
+
+    def test_round_trip(self):
+        t = Itable()
+        m = {n: ihash() for n in (0, 1, ITABLE_CHUNK, 3 * ITABLE_CHUNK + 1)}
+        for n, h in m.items():
+            t[n] = h
+        loaded = Itable.load(secfs.store.block.store(t.bytes()))
+        self.assertEqual(loaded.next, t.next)
+        self.assertEqual(dict(loaded.mapping), m)
+
+    def test_only_dirty_chunks_are_stored(self):
+        t = Itable()
+        for n in range(3 * ITABLE_CHUNK):
+            t[n] = ihash()
+        t.bytes()
+
+        blocks = len(self.server.blocks)
+        t[ITABLE_CHUNK + 1] = ihash()
+        t.bytes()
+        # just the one chunk; the top-level block is returned, not stored
+        self.assertEqual(len(self.server.blocks) - blocks, 1)
+
+        loaded = Itable.load(secfs.store.block.store(t.bytes()))
+        self.assertEqual(loaded.mapping, t.mapping)
+
+class ResolveTest(unittest.TestCase):
+    def setUp(self):
+        secfs.local.mount(secfs.local.LocalServer())
+
+    def _replace(self, principal, n, h):
+        # the way a newer itable from the server replaces the current one
+        t = Itable()
+        for m, old in secfs.tables.current_itables[principal].mapping.items():
+            t[m] = old
+        t[n] = h
+        secfs.tables.set_itable(principal, t)
+
+    def test_user(self):
+        h = ihash()
+        i = secfs.tables.modmap(owner, I(owner), h)
+        self.assertEqual(resolve(i), h)
+        self.assertEqual(resolve(i), h)
+
+        h2 = ihash()
+        self._replace(owner, i.n, h2)
+        self.assertEqual(resolve(i), h2)
+
+    def test_group(self):
+        h = ihash()
+        ui = secfs.tables.modmap(owner, I(owner), h)
+        gi = secfs.tables.modmap(owner, I(group), ui)
+        self.assertEqual(resolve(gi), h)
+        self.assertEqual(resolve(gi, False), ui)
+
+        # the user i the group i points to is remapped
+        h2 = ihash()
+        self._replace(owner, ui.n, h2)
+        self.assertEqual(resolve(gi), h2)
+
+        # the group i itself is pointed elsewhere
+        h3 = ihash()
+        ui3 = secfs.tables.modmap(owner, I(owner), h3)
+        resolve(gi)
+        self._replace(group, gi.n, ui3)
+        self.assertEqual(resolve(gi, False), ui3)
+        self.assertEqual(resolve(gi), h3)
+
+class PublishTest(unittest.TestCase):
+    def test_not_collecting(self):
+        server = secfs.local.LocalServer()
+        root = secfs.local.mount(server)
+        secfs.local.create(root, b"f")
+        self.assertTrue(secfs.tables.post(True))
+        self.assertEqual(server.itables, {})
+        self.assertFalse(secfs.tables.post(True))
+
+    def test_collecting(self):
+        server = secfs.local.LocalServer(collecting=True)
+        root = secfs.local.mount(server)
+        secfs.local.create(root, b"f")
+        self.assertTrue(secfs.tables.post(True))
+        t = Itable.load(server.itables[(False, owner.id)])
+        self.assertEqual(t.mapping, secfs.tables.current_itables[owner].mapping)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import pickle
+import unittest
+
+import secfs.fs
+import secfs.local
+import secfs.tables
+import secfs.store.tree
+from secfs.local import owner
+from secfs.store.tree import Directory, BUCKET_ENTRIES, _pack_bucket, _unpack_bucket
+from secfs.types import I, User, Group
+
+class BucketEncodingTest(unittest.TestCase):
+    def test_round_trip(self):
+        bucket = [("file{}".format(n).encode(), I(User(1000 + n % 2), n)) for n in range(20)]
+        bucket.append((b"", I(Group(7), 1)))
+        bucket.append(("é".encode() * 100, I(User(0), 2 ** 40)))
+        self.assertEqual(_unpack_bucket(_pack_bucket(bucket)), bucket)
+
+    def test_empty(self):
+        self.assertEqual(_unpack_bucket(_pack_bucket([])), [])
+        self.assertEqual(_unpack_bucket(b""), [])
+
+    def test_pickled_bucket(self):
+        bucket = [(b"a", I(User(1), 2))]
+        self.assertEqual(_unpack_bucket(pickle.dumps(bucket)), bucket)
+
+class DirectoryTest(unittest.TestCase):
+    def setUp(self):
+        self.root = secfs.local.mount(secfs.local.LocalServer())
+
+    def test_split(self):
+        d = secfs.local.create(self.root, b"d", isdir=True)
+        names = ["f{}".format(n).encode() for n in range(3 * BUCKET_ENTRIES)]
+        for name in names:
+            ihash = secfs.store.tree.add(d, name, I(owner, 1))
+            secfs.tables.modmap(owner, d, ihash)
+
+        dr = Directory(d)
+        self.assertGreater(dr.nbuckets, 3)
+        for b in range(dr.nbuckets):
+            self.assertLessEqual(len(dr._bucket(b)), BUCKET_ENTRIES)
+        self.assertEqual(sorted(n for n, _ in dr.children), sorted(names + [b".", b".."]))
+        for name in names:
+            self.assertEqual(secfs.store.tree.find_under(d, name), I(owner, 1))
+        self.assertIsNone(secfs.store.tree.find_under(d, b"missing"))
+
+    def test_duplicate(self):
+        secfs.local.create(self.root, b"f")
+        with self.assertRaises(KeyError):
+            secfs.store.tree.add(self.root, b"f", I(owner, 1))
+
+    def test_readdir_attrs(self):
+        f = secfs.local.create(self.root, b"f")
+        ihash = secfs.store.tree.add(self.root, b"ghost", I(User(7), 3))
+        secfs.tables.modmap(owner, self.root, ihash)
+
+        entries = {name: (i, n) for name, i, n, _ in secfs.fs.readdir_attrs(self.root, 0)}
+        self.assertEqual(entries[b"f"][0], f)
+        self.assertEqual(entries[b"f"][1].kind, 1)
+        self.assertEqual(entries[b"."][1].kind, 0)
+        # an i that does not resolve has no inode to load
+        self.assertIsNone(entries[b"ghost"][1])
+
+if __name__ == '__main__':
+    unittest.main()
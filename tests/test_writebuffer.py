@@ -0,0 +1,56 @@
+import unittest
+
+from secfs.fs import WriteBuffer
+
+def extents(wb):
+    return [(off, bytes(data)) for off, data in wb.extents]
+
+class WriteBufferTest(unittest.TestCase):
+    def test_sequential(self):
+        wb = WriteBuffer()
+        wb.add(0, b"abc")
+        wb.add(3, b"def")
+        self.assertEqual(extents(wb), [(0, b"abcdef")])
+        self.assertEqual(wb.size, 6)
+        self.assertEqual(wb.end, 6)
+
+    def test_disjoint(self):
+        wb = WriteBuffer()
+        wb.add(10, b"xy")
+        wb.add(0, b"ab")
+        self.assertEqual(extents(wb), [(0, b"ab"), (10, b"xy")])
+        self.assertEqual(wb.size, 4)
+        self.assertEqual(wb.end, 12)
+
+    def test_overlap_later_wins(self):
+        wb = WriteBuffer()
+        wb.add(0, b"aaaa")
+        wb.add(2, b"bbbb")
+        wb.add(1, b"c")
+        self.assertEqual(extents(wb), [(0, b"acbbbb")])
+        self.assertEqual(wb.size, 6)
+
+    def test_adjacent_before(self):
+        wb = WriteBuffer()
+        wb.add(4, b"efgh")
+        wb.add(0, b"abcd")
+        self.assertEqual(extents(wb), [(0, b"abcdefgh")])
+
+    def test_bridge(self):
+        wb = WriteBuffer()
+        wb.add(0, b"aa")
+        wb.add(6, b"cc")
+        wb.add(2, b"bbbb")
+        self.assertEqual(extents(wb), [(0, b"aabbbbcc")])
+        self.assertEqual(wb.size, 8)
+
+    def test_clear(self):
+        wb = WriteBuffer()
+        wb.add(5, b"x")
+        self.assertIsNotNone(wb.since)
+        wb.clear()
+        self.assertEqual(wb.extents, [])
+        self.assertEqual((wb.size, wb.end, wb.since), (0, 0, None))
+
+if __name__ == '__main__':
+    unittest.main()